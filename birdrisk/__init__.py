@@ -0,0 +1,6 @@
+"""Shared data access and analysis helpers for the birdRisk Streamlit pages.
+"""
+import os
+
+# Root folder of all local stores (VPTS cache, aggregates, ...)
+CACHE_DIR = os.environ.get('BIRDRISK_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'birdrisk'))
@@ -0,0 +1,224 @@
+"""Multi-year VPTS climatology per radar, day of year, time of day and height.
+
+Every ingested day is reduced to count, sum and sum of squares of the density
+plus a log-spaced histogram per time bin and height bin. These are additive,
+so the aggregate over any set of baseline years, including its means and
+approximate quantiles, is a sum over a few thousand rows of one small file.
+New days are appended without touching the days already stored. The
+ingested years of a file are also kept in its metadata, so a day without any
+valid density counts as stored and is not downloaded again. Years whose
+download failed are kept there too, with the time of the failure, and are not
+requested again until failed_ttl has passed.
+"""
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from birdrisk import CACHE_DIR
+
+# Histogram edges of the density in birds/km3, the last bin is open ended
+HIST_EDGES = np.concatenate([[0.0], np.logspace(-2, 4, 25)])
+HIST_COLUMNS = [f'h{i:02d}' for i in range(len(HIST_EDGES))]
+QUANTILES = (0.1, 0.5, 0.9)
+YEARS_KEY = b'birdrisk.years'
+FAILED_KEY = b'birdrisk.failed'
+# Years that could not be downloaded, e.g. 404 for a year without data, are retried after this
+FAILED_TTL = timedelta(days=1)
+
+
+def day_of_year(date):
+    """ Returns the day of the year in a leap year calendar, so 1 March is always day 61. """
+    return date.replace(year=2000).timetuple().tm_yday
+
+
+def aggregate_day(frame, time_bin_minutes=15):
+    """ Reduces one day of VPTS (datetime, height, dens) to the additive statistics per time and height bin. """
+    frame = frame[frame['dens'].notna()]
+    minutes = frame['datetime'].dt.hour * 60 + frame['datetime'].dt.minute
+    tbin = (minutes // time_bin_minutes * time_bin_minutes).to_numpy(np.int16)
+    height = frame['height'].to_numpy(np.int16)
+    dens = frame['dens'].to_numpy(np.float64)
+
+    keys, cell = np.unique(np.stack([tbin, height], axis=1), axis=0, return_inverse=True)
+    cell = cell.ravel()
+    n_cells = len(keys)
+    hist_bin = np.clip(np.searchsorted(HIST_EDGES, dens, side='right') - 1, 0, len(HIST_EDGES) - 1)
+    hist = np.bincount(cell * len(HIST_EDGES) + hist_bin, minlength=n_cells * len(HIST_EDGES))
+
+    stats = pd.DataFrame({
+        'tbin': keys[:, 0].astype(np.int16),
+        'height': keys[:, 1].astype(np.int16),
+        'count': np.bincount(cell, minlength=n_cells).astype(np.uint32),
+        'sum': np.bincount(cell, weights=dens, minlength=n_cells),
+        'sumsq': np.bincount(cell, weights=dens ** 2, minlength=n_cells),
+    })
+    hist = pd.DataFrame(hist.reshape(n_cells, len(HIST_EDGES)).astype(np.uint32), columns=HIST_COLUMNS)
+    return pd.concat([stats, hist], axis=1)
+
+
+def hist_quantiles(hist, quantiles=QUANTILES):
+    """ Estimates quantiles from histogram rows, interpolating log-linearly inside a bin. """
+    hist = np.asarray(hist, dtype=np.float64)
+    cum = np.cumsum(hist, axis=1)
+    total = cum[:, -1]
+    lower = HIST_EDGES
+    upper = np.append(HIST_EDGES[1:], HIST_EDGES[-1])
+    result = {}
+    for q in quantiles:
+        target = q * total
+        idx = np.minimum((cum < target[:, None]).sum(axis=1), len(HIST_EDGES) - 1)
+        below = np.where(idx > 0, cum[np.arange(len(idx)), idx - 1], 0.0)
+        inside = hist[np.arange(len(idx)), idx]
+        frac = np.divide(target - below, inside, out=np.zeros_like(target), where=inside > 0)
+        lo, hi = lower[idx], upper[idx]
+        # the first bin starts at 0 and is interpolated linearly
+        log_value = np.exp(np.log(np.maximum(lo, 1e-12)) + frac * (np.log(hi) - np.log(np.maximum(lo, 1e-12))))
+        value = np.where(idx == 0, frac * hi, log_value)
+        result[f'q{int(round(q * 100)):02d}'] = np.where(total > 0, value, np.nan)
+    return pd.DataFrame(result)
+
+
+class ClimatologyStore:
+    """Per radar and day of year Parquet files with the aggregated statistics of every ingested year."""
+
+    def __init__(self, root=None, time_bin_minutes=15, failed_ttl=FAILED_TTL):
+        self.root = root or os.path.join(CACHE_DIR, 'climatology')
+        self.time_bin_minutes = time_bin_minutes
+        self.failed_ttl = failed_ttl
+        self._lock = threading.Lock()
+
+    def path(self, radar, doy):
+        return os.path.join(self.root, f'bin{self.time_bin_minutes}', radar, f'doy={doy:03d}.parquet')
+
+    def _read(self, radar, doy, years=None):
+        path = self.path(radar, doy)
+        if not os.path.exists(path):
+            return None
+        filters = [('year', 'in', list(years))] if years is not None else None
+        return pq.read_table(path, filters=filters).to_pandas()
+
+    def _metadata(self, path):
+        """ Returns the ingested years of a file and the time (s since the epoch) of the failed downloads per year.
+
+        Files written without the years metadata report the years of their rows.
+        """
+        if not os.path.exists(path):
+            return set(), {}
+        metadata = pq.read_schema(path).metadata or {}
+        failed = {int(year): when for year, when in json.loads(metadata.get(FAILED_KEY, b'{}')).items()}
+        if YEARS_KEY in metadata:
+            years = {int(year) for year in metadata[YEARS_KEY].decode().split(',') if year}
+        else:
+            years = set(pq.read_table(path, columns=['year']).column('year').unique().to_pylist())
+        return years, failed
+
+    def _write(self, path, day, years, failed):
+        table = pa.Table.from_pandas(day, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            YEARS_KEY: ','.join(str(year) for year in sorted(years)).encode(),
+            FAILED_KEY: json.dumps({str(year): when for year, when in sorted(failed.items())}).encode(),
+        })
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+
+    def _recent(self, failed):
+        now = time.time()
+        return {year for year, when in failed.items() if now - when < self.failed_ttl.total_seconds()}
+
+    def years(self, radar, date):
+        """ Returns the years stored for the day of year of date, including years without valid densities. """
+        return self._metadata(self.path(radar, day_of_year(date)))[0]
+
+    def failed_years(self, radar, date):
+        """ Returns the years of the day of year of date whose download failed less than failed_ttl ago. """
+        return self._recent(self._metadata(self.path(radar, day_of_year(date)))[1])
+
+    def missing(self, radar, dates):
+        """ Returns the dates that have not been ingested yet and did not fail to download recently. """
+        result = []
+        for date in dates:
+            years, failed = self._metadata(self.path(radar, day_of_year(date)))
+            if date.year not in years and date.year not in self._recent(failed):
+                result.append(date)
+        return result
+
+    def _day(self, date, frame):
+        day = aggregate_day(frame, self.time_bin_minutes)
+        day.insert(0, 'year', np.full(len(day), date.year, dtype=np.int16))
+        return day
+
+    def add_day(self, radar, date, frame):
+        """ Adds one day of VPTS to the store, days that are already stored are left untouched. """
+        doy = day_of_year(date)
+        day = self._day(date, frame)
+
+        with self._lock:
+            path = self.path(radar, doy)
+            years, failed = self._metadata(path)
+            if date.year in years:
+                return False
+            stored = self._read(radar, doy)
+            if stored is not None:
+                day = pd.concat([stored, day], ignore_index=True)
+            failed.pop(date.year, None)
+            self._write(path, day, years | {date.year}, failed)
+        return True
+
+    def add_failed(self, radar, dates):
+        """ Records that the given dates could not be downloaded, missing skips them for failed_ttl. """
+        empty = pd.DataFrame({'datetime': pd.Series([], dtype='datetime64[s, UTC]'),
+                              'height': pd.Series([], dtype=np.int16), 'dens': pd.Series([], dtype=np.float32)})
+        for date in dates:
+            doy = day_of_year(date)
+            with self._lock:
+                path = self.path(radar, doy)
+                years, failed = self._metadata(path)
+                if date.year in years:
+                    continue
+                stored = self._read(radar, doy)
+                failed[date.year] = time.time()
+                self._write(path, self._day(date, empty) if stored is None else stored, years, failed)
+
+    def add_days(self, radar, frames):
+        """ Adds several days given as a dict of date to VPTS frame. """
+        for date, frame in frames.items():
+            self.add_day(radar, date, frame)
+
+    def profile(self, radar, dates, quantiles=QUANTILES):
+        """ Aggregates the stored statistics of the given dates per time bin and height.
+
+        Returns the aggregate (tbin in minutes since midnight, height, count,
+        sum, mean, std and the quantile columns) and the dates found in the store.
+        """
+        parts, found = [], []
+        by_doy = {}
+        for date in dates:
+            by_doy.setdefault(day_of_year(date), []).append(date)
+        for doy, doy_dates in by_doy.items():
+            part = self._read(radar, doy, years={date.year for date in doy_dates})
+            if part is not None and len(part):
+                parts.append(part)
+                found += [date for date in doy_dates if date.year in set(part['year'])]
+
+        columns = ['tbin', 'height', 'count', 'sum', 'mean', 'std'] + [f'q{int(round(q * 100)):02d}' for q in quantiles]
+        if not parts:
+            return pd.DataFrame(columns=columns), found
+
+        agg = (pd.concat(parts, ignore_index=True)
+               .drop(columns='year')
+               .groupby(['tbin', 'height'], as_index=False).sum())
+        count = agg['count'].to_numpy(np.float64)
+        agg['mean'] = agg['sum'] / count
+        agg['std'] = np.sqrt(np.maximum(agg['sumsq'] / count - agg['mean'] ** 2, 0))
+        agg = pd.concat([agg, hist_quantiles(agg[HIST_COLUMNS], quantiles)], axis=1)
+        return agg[columns], sorted(found)
@@ -0,0 +1,225 @@
+"""Collision exposure of radar tracks to the rotors of a turbine layout.
+
+The rotor of a turbine can face any wind direction, so it sweeps a vertical
+cylinder around the tower: radius rotor_diameter / 2 between the lower and
+upper edge of its swept band (see exposure.swept_bands, in the height
+reference of the track z values). Tracks and turbines are projected to
+metres around a common origin.
+
+Track boxes are matched to the turbines with an STR-tree first. Only the
+segments of the remaining track and turbine pairs are tested against the
+cylinders, all pairs of a batch at once, and the batches run in a process
+pool that maps the track file.
+
+Evaluate a layout (CSV with lon, lat, hub_height, rotor_diameter and
+optionally ground_elevation), e.g.
+
+    python -m birdrisk.collision data/test_radar_data_for_reto.csv layout.csv exposure.csv
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from birdrisk.exposure import swept_bands, turbine_table
+from birdrisk.geo import local_xyz, segment_distance
+from birdrisk.tracks import get_tracks, load_tracks
+
+# Pairs coming this close (m) to a swept volume are reported with their closest approach
+SEARCH_DISTANCE = 200.0
+# Track and turbine pairs tested at once by one worker
+BATCH_PAIRS = 20000
+EXPOSURE_COLUMNS = ('track', 'id', 'turbine', 'crosses', 'time_inside', 'distance_inside', 'closest_approach')
+
+
+def rotor_cylinders(turbines, origin):
+    """ Returns x, y (m from origin), radius, lower and upper edge of the swept cylinder of every turbine. """
+    lower, upper = swept_bands(turbines)
+    centre = local_xyz(turbines['lon'], turbines['lat'], np.zeros(len(turbines)), origin)
+    radius = turbines['rotor_diameter'].to_numpy(np.float64) / 2
+    return centre[:, 0], centre[:, 1], radius, lower, upper
+
+
+def segment_cylinder(start, end, x, y, radius, lower, upper):
+    """ Returns the part [s0, s1] of the segments start-end (rows of 3-D points) inside vertical cylinders.
+
+    s runs from 0 at start to 1 at end, segments missing the cylinder get s1 < s0.
+    """
+    direction = end - start
+    # horizontally inside where |start + s * direction - centre| <= radius
+    dx, dy = direction[:, 0], direction[:, 1]
+    fx, fy = start[:, 0] - x, start[:, 1] - y
+    a = dx ** 2 + dy ** 2
+    b = 2 * (fx * dx + fy * dy)
+    c = fx ** 2 + fy ** 2 - radius ** 2
+    root = np.sqrt(np.clip(b ** 2 - 4 * a * c, 0, None))
+    moving = a > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h0 = np.where(moving, (-b - root) / (2 * a), np.where(c <= 0, -np.inf, np.inf))
+        h1 = np.where(moving, (-b + root) / (2 * a), np.where(c <= 0, np.inf, -np.inf))
+        h1 = np.where(moving & (b ** 2 - 4 * a * c < 0), -np.inf, h1)
+
+        # vertically inside between the edges of the swept band
+        dz, z = direction[:, 2], start[:, 2]
+        level = (z >= lower) & (z <= upper)
+        climbing = dz != 0
+        v0 = np.where(climbing, np.minimum((lower - z) / dz, (upper - z) / dz), np.where(level, -np.inf, np.inf))
+        v1 = np.where(climbing, np.maximum((lower - z) / dz, (upper - z) / dz), np.where(level, np.inf, -np.inf))
+    return np.maximum.reduce([h0, v0, np.zeros(len(start))]), np.minimum.reduce([h1, v1, np.ones(len(start))])
+
+
+def candidate_pairs(xyz, offsets, cylinders, search_distance=SEARCH_DISTANCE):
+    """ Returns the track and turbine indices of the pairs whose boxes come within search_distance. """
+    x, y, radius, lower, upper = cylinders
+    lengths = np.diff(offsets)
+    tracks = np.flatnonzero(lengths > 0)
+    if not len(tracks) or not len(x):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = offsets[:-1][tracks]
+    low = np.column_stack([np.minimum.reduceat(xyz[:, i], starts) for i in range(3)])
+    high = np.column_stack([np.maximum.reduceat(xyz[:, i], starts) for i in range(3)])
+
+    tree = shapely.STRtree(shapely.points(x, y))
+    boxes = shapely.box(low[:, 0], low[:, 1], high[:, 0], high[:, 1])
+    box, turbine = tree.query(boxes, predicate='dwithin', distance=radius.max() + search_distance)
+
+    # exact horizontal distance of the box to the tower and overlap with the swept band
+    gap_x = np.maximum.reduce([low[box, 0] - x[turbine], x[turbine] - high[box, 0], np.zeros(len(box))])
+    gap_y = np.maximum.reduce([low[box, 1] - y[turbine], y[turbine] - high[box, 1], np.zeros(len(box))])
+    near = np.hypot(gap_x, gap_y) <= radius[turbine] + search_distance
+    near &= (high[box, 2] >= lower[turbine] - search_distance) & (low[box, 2] <= upper[turbine] + search_distance)
+    order = np.lexsort((turbine[near], box[near]))
+    return tracks[box[near][order]], turbine[near][order]
+
+
+def pair_exposure(tracks, origin, pair_track, pair_turbine, cylinders):
+    """ Returns the exposure of track and turbine pairs as a dict of arrays, one value per pair.
+
+    tracks is a TrackSet or the path of a track file. The points are tested
+    first; only segments that could enter the cylinder or come closer to the
+    rotor centre than the nearest point are tested as segments.
+    """
+    if isinstance(tracks, str):
+        tracks = load_tracks(tracks)
+    x, y, radius, lower, upper = cylinders
+    unique, position = np.unique(pair_track, return_inverse=True)
+    offsets, points = tracks.gather(unique)
+    xyz = local_xyz(tracks.lon[points], tracks.lat[points], tracks.z[points], origin)
+
+    # points of every pair relative to the rotor centre
+    lengths = np.diff(offsets)[position]
+    pair_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    owner = np.repeat(np.arange(len(pair_track)), lengths)
+    index = np.repeat(offsets[:-1][position] - pair_offsets[:-1], lengths) + np.arange(pair_offsets[-1])
+    hub = np.column_stack([x, y, (lower + upper) / 2])[pair_turbine]
+    rel = xyz[index] - hub[owner]
+    radius, half_height = radius[pair_turbine], ((upper - lower) / 2)[pair_turbine]
+
+    horizontal = np.hypot(rel[:, 0], rel[:, 1])
+    distance = np.linalg.norm(rel, axis=1)
+    inside = (horizontal <= radius[owner]) & (np.abs(rel[:, 2]) <= half_height[owner])
+    crosses = np.logical_or.reduceat(inside, pair_offsets[:-1])
+    closest = np.minimum.reduceat(distance, pair_offsets[:-1])
+
+    # segments join consecutive points of a pair, a point of a segment is within half its length of an end
+    seg = np.flatnonzero(owner[:-1] == owner[1:])
+    seg_owner = owner[seg]
+    half = np.linalg.norm(rel[seg + 1] - rel[seg], axis=1) / 2
+    near = np.minimum(horizontal[seg], horizontal[seg + 1]) - half <= radius[seg_owner]
+    near &= np.minimum(rel[seg, 2], rel[seg + 1, 2]) <= half_height[seg_owner]
+    near &= np.maximum(rel[seg, 2], rel[seg + 1, 2]) >= -half_height[seg_owner]
+    closer = np.minimum(distance[seg], distance[seg + 1]) - half < closest[seg_owner]
+    seg, seg_owner, half = seg[near | closer], seg_owner[near | closer], half[near | closer]
+
+    start, end = rel[seg], rel[seg + 1]
+    s0, s1 = segment_cylinder(start, end, 0.0, 0.0, radius[seg_owner], -half_height[seg_owner],
+                              half_height[seg_owner])
+    share = np.clip(s1 - s0, 0, None)
+    duration = tracks.t[points[index[seg + 1]]].astype(np.float64) - tracks.t[points[index[seg]]]
+    crosses[seg_owner[s1 >= s0]] = True
+    np.minimum.at(closest, seg_owner, segment_distance(np.zeros_like(start), start, end))
+    return {
+        'crosses': crosses,
+        'time_inside': np.bincount(seg_owner, share * duration, minlength=len(pair_track)),
+        'distance_inside': np.bincount(seg_owner, share * 2 * half, minlength=len(pair_track)),
+        'closest_approach': closest,
+    }
+
+
+def collision_exposure(tracks, turbines, search_distance=SEARCH_DISTANCE, max_workers=None, batch_pairs=BATCH_PAIRS):
+    """ Returns the exposure of every track to every turbine of a layout it comes near.
+
+    turbines is a turbine_table with positions. There is one row per track
+    and turbine whose boxes come within search_distance (m): the track index
+    and id, the turbine index, whether the track passes through the swept
+    volume, the time (s) and path length (m) inside it and the closest
+    approach (m) to the rotor centre. Tracks from a file are tested in a
+    process pool, max_workers=1 tests in this process.
+    """
+    origin = (float(turbines['lon'].mean()), float(turbines['lat'].mean()))
+    cylinders = rotor_cylinders(turbines, origin)
+    pair_track, pair_turbine = candidate_pairs(local_xyz(tracks.lon, tracks.lat, tracks.z, origin), tracks.offsets,
+                                               cylinders, search_distance)
+
+    # batches end at a track boundary so every worker gathers its tracks once
+    bounds = np.unique(np.searchsorted(pair_track, pair_track[::batch_pairs])).tolist() + [len(pair_track)]
+    batches = [(pair_track[a:b], pair_turbine[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+    if tracks.path is None or max_workers == 1 or len(batches) < 2:
+        parts = [pair_exposure(tracks, origin, *batch, cylinders) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(pair_exposure, tracks.path, origin, *batch, cylinders) for batch in batches]
+            parts = [future.result() for future in futures]
+
+    result = pd.DataFrame({
+        'track': pair_track,
+        'id': tracks.table['id'].to_numpy()[pair_track],
+        'turbine': pair_turbine,
+    })
+    for name in EXPOSURE_COLUMNS[3:]:
+        result[name] = np.concatenate([part[name] for part in parts]) if parts else np.zeros(0)
+    result['crosses'] = result['crosses'].astype(bool)
+    return result
+
+
+def turbine_summary(exposure, turbines):
+    """ Returns per turbine the number of tracks through its swept volume, their time inside and the closest approach. """
+    crossing = exposure[exposure['crosses']]
+    summary = pd.DataFrame({
+        'tracks': crossing.groupby('turbine').size(),
+        'time_inside': crossing.groupby('turbine')['time_inside'].sum(),
+        'closest_approach': exposure.groupby('turbine')['closest_approach'].min(),
+    }).reindex(range(len(turbines)))
+    summary[['tracks', 'time_inside']] = summary[['tracks', 'time_inside']].fillna(0)
+    summary['tracks'] = summary['tracks'].astype(np.int64)
+    return pd.concat([turbines.reset_index(drop=True), summary.reset_index(drop=True)], axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collision exposure of radar tracks to a turbine layout.")
+    parser.add_argument('tracks', help="track export (CSV) or converted track file (Arrow)")
+    parser.add_argument('layout', help="CSV with lon, lat, hub_height, rotor_diameter and optionally ground_elevation")
+    parser.add_argument('output', nargs='?', default=None, help="CSV of the exposure per track and turbine")
+    parser.add_argument('--search-distance', type=float, default=SEARCH_DISTANCE,
+                        help="report pairs coming this close (m) to a swept volume")
+    parser.add_argument('--workers', type=int, default=None, help="processes testing the track batches")
+    args = parser.parse_args()
+
+    tracks = get_tracks(args.tracks) if args.tracks.endswith('.csv') else load_tracks(args.tracks)
+    layout = pd.read_csv(args.layout)
+    turbines = turbine_table(layout['hub_height'], layout['rotor_diameter'], layout.get('ground_elevation', 0.0),
+                             lon=layout['lon'], lat=layout['lat'])
+    exposure = collision_exposure(tracks, turbines, args.search_distance, args.workers)
+    if args.output:
+        exposure.to_csv(args.output, index=False)
+
+    summary = turbine_summary(exposure, turbines)
+    print(f"{exposure['crosses'].sum()} passages of {exposure.loc[exposure['crosses'], 'track'].nunique()} tracks "
+          f"through {(summary['tracks'] > 0).sum()} of {len(turbines)} rotors, "
+          f"{summary['time_inside'].sum():.0f} s inside")
+
+
+if __name__ == "__main__":
+    main()
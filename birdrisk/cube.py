@@ -0,0 +1,151 @@
+"""Occurrence cube: counts per species, year, month and H3 cell.
+
+The cube is built in batch from the occurrence store and written to one
+Parquet file sorted by resolution, species and year, so reads filtered on
+these columns only decode the row groups they need. Month 0 holds the
+occurrences without a usable event date.
+
+Build it for the stopover species, e.g.
+
+    python -m birdrisk.cube 2010 2024
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from birdrisk import CACHE_DIR
+from birdrisk.hexbin import PYRAMID_RESOLUTIONS, cell_counts, cell_parents, latlng_to_cells
+from birdrisk.occurrences import STOPOVER_SPECIES, OccurrenceStore, warm_up
+
+CUBE_PATH = os.path.join(CACHE_DIR, 'occurrence_cube.parquet')
+CUBE_SCHEMA = pa.schema([
+    ('resolution', pa.int8()),
+    ('species', pa.string()),
+    ('year', pa.int16()),
+    ('month', pa.int8()),
+    ('hex_index', pa.string()),
+    ('counts', pa.int32()),
+])
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def occurrence_months(event_dates):
+    """ Returns the month of ISO event dates (also ranges like 2023-05-01/2023-05-10), 0 where unknown. """
+    months = pd.to_numeric(pd.Series(event_dates, dtype='string').str[5:7], errors='coerce')
+    return months.where(months.between(1, 12)).fillna(0).to_numpy(np.int8)
+
+
+def cube_part(path, species, year, resolutions=PYRAMID_RESOLUTIONS):
+    """ Returns the cube rows of one stored species and year.
+
+    Every occurrence is indexed once at the finest resolution, the coarser
+    levels are counted per parent like hex_pyramid.
+    """
+    frame = pq.read_table(path, columns=['decimalLatitude', 'decimalLongitude', 'eventDate']).to_pandas()
+    frame = frame.dropna(subset=['decimalLatitude', 'decimalLongitude'])
+    resolutions = sorted(resolutions)
+    cells = latlng_to_cells(frame['decimalLatitude'], frame['decimalLongitude'], resolutions[-1])
+    months = occurrence_months(frame['eventDate'])
+
+    parts = []
+    for month in np.unique(months):
+        fine, counts = np.unique(cells[months == month], return_counts=True)
+        for resolution in resolutions:
+            part = cell_counts(cell_parents(fine, resolution), counts)
+            part.insert(0, 'month', month)
+            part.insert(0, 'resolution', resolution)
+            parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=CUBE_SCHEMA.names)
+    result = pd.concat(parts, ignore_index=True)
+    result.insert(1, 'species', species)
+    result.insert(2, 'year', year)
+    return result
+
+
+def build_cube(store, species, years, path=CUBE_PATH, resolutions=PYRAMID_RESOLUTIONS, sync=True,
+               max_workers=None, progress=None):
+    """ Builds the cube of all species and years and writes it to path.
+
+    With sync the store is brought up to date first (see warm_up). The stored
+    species and years are then aggregated in a process pool. Returns the
+    sync errors keyed by (species, year); combinations missing from the store
+    are left out of the cube. progress is called with the number of
+    aggregated entries and the total.
+    """
+    errors = warm_up(store, species, years) if sync else {}
+    tasks = [(name, year) for name in species for year in years if store.exists(name, year)]
+
+    parts = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(cube_part, store.path(name, year), name, year, resolutions) for name, year in tasks]
+        for done, future in enumerate(futures, start=1):
+            parts.append(future.result())
+            if progress:
+                progress(done, len(tasks))
+
+    cube = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=CUBE_SCHEMA.names)
+    cube = cube.sort_values(['resolution', 'species', 'year', 'month', 'counts'],
+                            ascending=[True, True, True, True, False], ignore_index=True)
+    table = pa.Table.from_pandas(cube, schema=CUBE_SCHEMA, preserve_index=False)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    pq.write_table(table, tmp_path, compression='zstd', row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+    return errors
+
+
+def read_cube(path=CUBE_PATH, species=None, years=None, months=None, resolution=None, columns=None):
+    """ Returns a slice of the cube; species, years and months are single values or sequences. """
+    filters = [('resolution', '=', resolution)] if resolution is not None else []
+    for column, values in (('species', species), ('year', years), ('month', months)):
+        if values is None:
+            continue
+        values = [values] if np.isscalar(values) else list(values)
+        filters.append((column, 'in', values))
+    return pq.read_table(path, columns=columns, filters=filters or None).to_pandas()
+
+
+def monthly_counts(path=CUBE_PATH, species=None, years=None):
+    """ Returns the occurrences per species, year and month, read from the coarsest resolution. """
+    columns = ['species', 'year', 'month', 'counts']
+    # every resolution holds all occurrences, the coarsest one has the fewest rows
+    resolution = pc.min(pq.read_table(path, columns=['resolution'])['resolution']).as_py()
+    if resolution is None:
+        return pd.DataFrame(columns=columns)
+    cube = read_cube(path, species, years, resolution=resolution, columns=columns)
+    return cube.groupby(['species', 'year', 'month'], as_index=False)['counts'].sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the species x year x month x H3 cell occurrence cube.")
+    parser.add_argument('start', type=int, help="first year")
+    parser.add_argument('end', type=int, help="last year")
+    parser.add_argument('--species', action='append',
+                        help="scientific name, can be repeated (default: the species of the stopover page)")
+    parser.add_argument('--cache-dir', default=None, help="root of the local GBIF store")
+    parser.add_argument('--output', default=CUBE_PATH, help="Parquet file of the cube")
+    parser.add_argument('--workers', type=int, default=None, help="processes aggregating the stored years")
+    parser.add_argument('--no-sync', action='store_true', help="only use the years already in the store")
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} species and years aggregated", end='', flush=True)
+
+    store = OccurrenceStore(root=args.cache_dir)
+    errors = build_cube(store, args.species or STOPOVER_SPECIES, range(args.start, args.end + 1), args.output,
+                        sync=not args.no_sync, max_workers=args.workers, progress=progress)
+    print()
+    for (name, year), error in sorted(errors.items()):
+        print(f"{name} {year}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Exposure of migrating birds to the rotor swept zone of wind turbines.
+
+A turbine sweeps the height band ground_elevation + hub_height -/+ rotor_diameter / 2
+(m above sea level, like the VPTS heights). The share of every height bin
+inside a band is its overlap with the band, so the exposure of any number of
+turbine designs follows from one matrix product with the density profiles.
+"""
+import numpy as np
+import pandas as pd
+
+from birdrisk.grid import height_interval
+
+
+def turbine_table(hub_height, rotor_diameter, ground_elevation=0.0, lon=None, lat=None):
+    """ Returns a table of turbine configurations, arguments are scalars or equally long sequences.
+
+    With lon and lat (degrees) the turbines have positions, e.g. a layout for
+    the track collision engine.
+    """
+    columns = {'hub_height': hub_height, 'rotor_diameter': rotor_diameter, 'ground_elevation': ground_elevation}
+    if lon is not None and lat is not None:
+        columns.update(lon=lon, lat=lat)
+    arrays = np.broadcast_arrays(*(np.asarray(value, dtype=np.float64) for value in columns.values()))
+    return pd.DataFrame({name: np.atleast_1d(array) for name, array in zip(columns, arrays)})
+
+
+def swept_bands(turbines):
+    """ Returns the lower and upper edge (m above sea level) of the swept band of each turbine. """
+    ground = turbines['ground_elevation'].to_numpy(np.float64) if 'ground_elevation' in turbines else 0.0
+    hub = ground + turbines['hub_height'].to_numpy(np.float64)
+    radius = turbines['rotor_diameter'].to_numpy(np.float64) / 2
+    return hub - radius, hub + radius
+
+
+def band_overlap(heights, lower, upper, bin_width=None):
+    """ Returns the overlap in m of every height bin [h, h + bin_width) with every band, shape (n_bands, n_heights). """
+    heights = np.asarray(heights, dtype=np.float64)
+    bin_width = bin_width or height_interval(heights)
+    top = np.minimum(np.asarray(upper)[:, None], heights[None, :] + bin_width)
+    bottom = np.maximum(np.asarray(lower)[:, None], heights[None, :])
+    return np.clip(top - bottom, 0, None)
+
+
+def swept_exposure(dens, heights, turbines, bin_width=None, sum_axes=None):
+    """ Computes the bird density in the swept band of every turbine configuration.
+
+    dens holds densities in birds/km3 with the height bins in the last axis and
+    any leading axes (radar, day, time, ...); missing values count as 0. With
+    sum_axes the leading axes are summed before the fraction is taken, e.g.
+    sum_axes=0 on a (time, height) grid gives the share over the whole day.
+
+    Returns a dict of arrays with the turbines in the last axis: 'density' the
+    birds/km2 within the band, 'total' the birds/km2 over the whole profile
+    (no turbine axis) and 'fraction' their ratio.
+    """
+    heights = np.asarray(heights, dtype=np.float64)
+    bin_width = bin_width or height_interval(heights)
+    dens = np.nan_to_num(np.asarray(dens, dtype=np.float64))
+    if sum_axes is not None:
+        dens = dens.sum(axis=sum_axes)
+
+    lower, upper = swept_bands(turbines)
+    overlap_km = band_overlap(heights, lower, upper, bin_width) / 1000
+    density = dens @ overlap_km.T
+    total = dens.sum(axis=-1) * bin_width / 1000
+    fraction = np.divide(density, total[..., None], out=np.full(density.shape, np.nan),
+                         where=total[..., None] > 0)
+    return {'density': density, 'total': total, 'fraction': fraction}
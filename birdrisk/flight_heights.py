@@ -0,0 +1,225 @@
+"""Flight height distributions of the radar tracks per species, month and hour.
+
+Every track file adds a histogram of flight time (s) per common_name, month,
+hour (of the track timestamps) and height bin. The time of a segment is
+split over the bins it passes, with the height linear in time, so the
+histograms are exact up to the bin width and can be added up. The store
+keeps one histogram part per track file and their sum; adding a new or
+changed file only reads that file, the sum is rebuilt from the parts.
+
+Add track exports to the store, e.g.
+
+    python -m birdrisk.flight_heights data/test_radar_data_for_reto.csv
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from birdrisk import CACHE_DIR
+from birdrisk.tracks import get_tracks, load_tracks, source_signature
+
+# Width (m) of the height bins, bin b holds the heights [b * HEIGHT_BIN, (b + 1) * HEIGHT_BIN)
+HEIGHT_BIN = 5.0
+# Points per chunk of tracks, bounds the memory of adding a season
+CHUNK_POINTS = 2 ** 22
+HISTOGRAM_SCHEMA = pa.schema([
+    ('common_name', pa.string()),
+    ('month', pa.int8()),
+    ('hour', pa.int8()),
+    ('bin', pa.int16()),
+    ('seconds', pa.float64()),
+])
+SOURCE_KEY = b'birdrisk.source'
+
+
+def _histogram_part(tracks, first, stop, codes, start_ms, bin_width):
+    """ Returns the keys (species code, month, hour and bin packed in an int64) and flight time of tracks first:stop. """
+    begin, end = tracks.offsets[first], tracks.offsets[stop]
+    z = tracks.z[begin:end].astype(np.float64)
+    t = tracks.t[begin:end].astype(np.float64)
+    owner = np.repeat(np.arange(first, stop), np.diff(tracks.offsets[first:stop + 1]))
+    # segment i joins point i and i + 1, the segments across track ends are dropped
+    seg = np.flatnonzero(owner[:-1] == owner[1:])
+    owner = owner[seg]
+    low, high = np.minimum(z[seg], z[seg + 1]), np.maximum(z[seg], z[seg + 1])
+    middle = start_ms[owner] + ((t[seg] + t[seg + 1]) / 2 * 1000).astype('timedelta64[ms]')
+    duration = t[seg + 1] - t[seg]
+
+    # one entry per segment and bin it passes, almost all segments stay in one bin
+    first_bin = np.floor(low / bin_width).astype(np.int64)
+    bins = np.floor(high / bin_width).astype(np.int64) - first_bin + 1
+    entry = np.repeat(np.arange(len(seg)), bins)
+    height_bin = np.repeat(first_bin - np.concatenate([[0], np.cumsum(bins)[:-1]]), bins) + np.arange(bins.sum())
+    overlap = (np.minimum(high[entry], (height_bin + 1) * bin_width)
+               - np.maximum(low[entry], height_bin * bin_width))
+    span = (high - low)[entry]
+    seconds = duration[entry] * np.divide(overlap, span, out=np.ones(len(entry)), where=span > 0)
+
+    month = middle.astype('datetime64[M]').astype(np.int64) % 12
+    hour = middle.astype('datetime64[h]').astype(np.int64) % 24
+    group = (codes[owner] * 12 + month) * 24 + hour
+    keys = group[entry] * 2 ** 16 + np.clip(height_bin + 2 ** 15, 0, 2 ** 16 - 1)
+    keys, inverse = np.unique(keys[seconds > 0], return_inverse=True)
+    return keys, np.bincount(inverse.ravel(), seconds[seconds > 0], minlength=len(keys))
+
+
+def height_histogram(tracks, bin_width=HEIGHT_BIN, chunk_points=CHUNK_POINTS):
+    """ Returns the flight time (s) of a TrackSet per common_name, month, hour and height bin.
+
+    The month and hour are those of the middle of every segment. Tracks are
+    processed in chunks of about chunk_points points.
+    """
+    names = tracks.table['common_name'].to_pandas().astype('category')
+    codes = names.cat.codes.to_numpy().astype(np.int64)
+    categories = np.append(names.cat.categories.astype(str).to_numpy(), 'unknown')
+    codes[codes < 0] = len(categories) - 1
+    start_ms = tracks.table['timestamp_start'].to_numpy().astype('datetime64[ms]')
+
+    bounds = np.unique(np.searchsorted(tracks.offsets, np.arange(0, tracks.offsets[-1], chunk_points), 'right') - 1)
+    bounds = np.append(bounds, len(tracks)) if len(tracks) else np.zeros(1, dtype=np.int64)
+    parts = [_histogram_part(tracks, first, stop, codes, start_ms, bin_width)
+             for first, stop in zip(bounds[:-1], bounds[1:])]
+    keys = np.concatenate([keys for keys, _ in parts]) if parts else np.zeros(0, dtype=np.int64)
+    seconds = np.concatenate([seconds for _, seconds in parts]) if parts else np.zeros(0)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    seconds = np.bincount(inverse.ravel(), seconds, minlength=len(keys))
+
+    group, height_bin = keys // 2 ** 16, keys % 2 ** 16 - 2 ** 15
+    return pd.DataFrame({
+        'common_name': categories[group // (12 * 24)],
+        'month': (group // 24 % 12 + 1).astype(np.int8),
+        'hour': (group % 24).astype(np.int8),
+        'bin': height_bin.astype(np.int16),
+        'seconds': seconds,
+    })
+
+
+class FlightHeightStore:
+    """Histogram parts of the added track files and their sum.
+
+    Queries are answered from the sum, which is read once and kept in memory
+    until the store changes.
+    """
+
+    def __init__(self, root=None, bin_width=HEIGHT_BIN):
+        self.root = root or os.path.join(CACHE_DIR, 'flight_heights')
+        self.bin_width = bin_width
+        self._total = None
+        self._total_mtime = None
+
+    @property
+    def total_path(self):
+        return os.path.join(self.root, 'total.parquet')
+
+    def part_path(self, source):
+        # the folder is part of the key, exports of different radars often share a file name
+        key = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:8]
+        name = os.path.splitext(os.path.basename(source))[0]
+        return os.path.join(self.root, 'parts', f'{name}-{key}.parquet')
+
+    def _write(self, path, table):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+
+    def is_current(self, source):
+        """ Returns whether the store holds the histogram of the current version of a track file. """
+        try:
+            metadata = pq.read_schema(self.part_path(source)).metadata or {}
+        except FileNotFoundError:
+            return False
+        return metadata.get(SOURCE_KEY) == source_signature(source).encode()
+
+    def add(self, source, force=False, rebuild=True):
+        """ Adds the histogram of a track file (export CSV or Arrow track file) unless it is current.
+
+        Returns whether the file was read. With rebuild=False the sum is left
+        for a later rebuild, e.g. when adding many files.
+        """
+        if self.is_current(source) and not force:
+            return False
+        signature = source_signature(source)
+        tracks = get_tracks(source) if source.endswith('.csv') else load_tracks(source)
+        table = pa.Table.from_pandas(height_histogram(tracks, self.bin_width), schema=HISTOGRAM_SCHEMA,
+                                     preserve_index=False)
+        table = table.replace_schema_metadata({SOURCE_KEY: signature.encode()})
+        self._write(self.part_path(source), table)
+        if rebuild:
+            self.rebuild()
+        return True
+
+    def update(self, sources, force=False):
+        """ Adds all new or changed track files and rebuilds the sum once. Returns the files read. """
+        added = [source for source in sources if self.add(source, force, rebuild=False)]
+        if added or not os.path.exists(self.total_path):
+            self.rebuild()
+        return added
+
+    def rebuild(self):
+        """ Sums the histogram parts of all added files. """
+        folder = os.path.join(self.root, 'parts')
+        names = sorted(name for name in os.listdir(folder) if name.endswith('.parquet')) if os.path.isdir(folder) else []
+        parts = [pq.read_table(os.path.join(folder, name)).to_pandas() for name in names]
+        total = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=HISTOGRAM_SCHEMA.names)
+        total = total.groupby(['common_name', 'month', 'hour', 'bin'], as_index=False)['seconds'].sum()
+        self._write(self.total_path, pa.Table.from_pandas(total, schema=HISTOGRAM_SCHEMA, preserve_index=False))
+
+    def total(self):
+        """ Returns the summed histogram, read again only when the store was rebuilt. """
+        mtime = os.path.getmtime(self.total_path)
+        if self._total is None or mtime != self._total_mtime:
+            self._total = pq.read_table(self.total_path).to_pandas()
+            self._total_mtime = mtime
+        return self._total
+
+    def species(self):
+        return sorted(self.total()['common_name'].unique())
+
+    def histogram(self, species=None, months=None, hours=None):
+        """ Returns the flight time (s) per height bin (lower edge in m) of the selected species, months and hours. """
+        total = self.total()
+        keep = np.ones(len(total), dtype=bool)
+        for column, values in (('common_name', species), ('month', months), ('hour', hours)):
+            if values is not None:
+                keep &= total[column].isin(np.atleast_1d(values)).to_numpy()
+        seconds = total[keep].groupby('bin')['seconds'].sum()
+        seconds.index = seconds.index.astype(np.float64) * self.bin_width
+        seconds.index.name = 'height'
+        return seconds
+
+    def proportion(self, species=None, lower=-np.inf, upper=np.inf, months=None, hours=None):
+        """ Returns the share of flight time between lower and upper (m), NaN without flight time.
+
+        Bins cut by a bound count with the part of their width inside it.
+        """
+        seconds = self.histogram(species, months, hours)
+        if not seconds.sum() > 0:
+            return np.nan
+        edges = seconds.index.to_numpy()
+        overlap = np.clip(np.minimum(edges + self.bin_width, upper) - np.maximum(edges, lower), 0, None)
+        return float((seconds.to_numpy() * overlap / self.bin_width).sum() / seconds.sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add radar track files to the flight height store.")
+    parser.add_argument('sources', nargs='+', help="track exports (CSV) or converted track files (Arrow)")
+    parser.add_argument('--cache-dir', default=None, help="root of the flight height store")
+    parser.add_argument('--force', action='store_true', help="read the files even if they are current")
+    args = parser.parse_args()
+
+    store = FlightHeightStore(root=args.cache_dir)
+    added = store.update(args.sources, args.force)
+    print(f"{len(added)} of {len(args.sources)} files read")
+    for species in store.species():
+        hours = store.histogram(species).sum() / 3600
+        print(f"{species}: {hours:.1f} h, {store.proportion(species, upper=200):.0%} below 200 m")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Paged access to the GBIF occurrence search API.
+
+The first page tells how many records match, the remaining pages are then
+requested concurrently over one pooled session. The number of requests in
+flight adapts to the server: it grows by one with every successful page and
+is halved whenever GBIF answers 429 or a 5xx error, which are retried with
+exponential backoff.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from birdrisk.sessions import get_session
+
+GBIF_API_URL = 'https://api.gbif.org/v1/occurrence/search'
+
+# Largest page GBIF serves, and the largest offset + limit the search API allows
+PAGE_LIMIT = 300
+MAX_RECORDS = 100000
+MAX_WORKERS = 8
+# (connect, read) timeout in seconds of every page
+TIMEOUT = (5, 60)
+# Responses that are retried, with the first backoff in seconds doubled on every attempt
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF = 0.5
+
+# Pool name of the GBIF requests in birdrisk.sessions
+SESSION_NAME = 'gbif'
+
+
+class AdaptiveLimit:
+    """Bounds the number of requests in flight between 1 and maximum.
+
+    The limit grows by one after every success and is halved after every
+    throttled or failed response (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, maximum=MAX_WORKERS, initial=2):
+        self.maximum = maximum
+        self.limit = min(initial, maximum)
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def success(self):
+        with self._condition:
+            self.limit = min(self.limit + 1, self.maximum)
+            self._condition.notify_all()
+
+    def throttle(self):
+        with self._condition:
+            self.limit = max(self.limit // 2, 1)
+
+
+def occurrence_params(species, year=None, country='NO'):
+    """ Returns the search parameters of the georeferenced occurrences of a species published by a country. """
+    params = {
+        'scientificName': species,
+        'hasCoordinate': 'true',
+        'publishingCountry': country,
+    }
+    if year:
+        params['year'] = year
+    return params
+
+
+def fetch_page(params, offset, limit=PAGE_LIMIT, base_url=GBIF_API_URL, session=None, timeout=TIMEOUT,
+               limiter=None, retries=MAX_RETRIES):
+    """ Returns the JSON of one page of search results.
+
+    429 and 5xx responses and connection errors are retried up to retries times,
+    waiting for Retry-After if the server sends it, otherwise for an exponential
+    backoff with jitter. Other errors raise requests.HTTPError.
+    """
+    session = session or get_session(SESSION_NAME)
+    limiter = limiter or AdaptiveLimit()
+    params = dict(params, offset=offset, limit=limit)
+    for attempt in range(retries + 1):
+        try:
+            with limiter:
+                response = session.get(base_url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            limiter.throttle()
+            time.sleep(BACKOFF * 2 ** attempt * (1 + random.random()))
+            continue
+
+        if response.status_code in RETRY_STATUS and attempt < retries:
+            limiter.throttle()
+            retry_after = response.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else BACKOFF * 2 ** attempt * (1 + random.random())
+            time.sleep(delay)
+            continue
+        response.raise_for_status()
+        limiter.success()
+        return response.json()
+
+
+def iter_pages(params, base_url=GBIF_API_URL, limit=PAGE_LIMIT, max_workers=MAX_WORKERS, max_records=MAX_RECORDS,
+               session=None, timeout=TIMEOUT):
+    """ Yields the result lists of all pages of a search, as soon as each one arrives.
+
+    The first page is fetched alone to read the total count, the others in
+    parallel, so pages after the first are yielded in completion order, not by
+    offset. Fetching stops at max_records, the last page is shortened so
+    offset + limit never exceeds it (GBIF rejects offset + limit above
+    MAX_RECORDS). A page failing after its retries
+    raises and cancels the pages not started yet.
+    """
+    session = session or get_session(SESSION_NAME, max_workers)
+    limiter = AdaptiveLimit(max_workers)
+    first = fetch_page(params, 0, min(limit, max_records), base_url, session, timeout, limiter)
+    yield first.get('results', [])
+
+    total = min(first.get('count', 0), max_records)
+    offsets = range(limit, total, limit)
+    if not offsets or first.get('endOfRecords', False):
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_page, params, offset, min(limit, total - offset), base_url, session,
+                                   timeout, limiter)
+                   for offset in offsets]
+        try:
+            for future in as_completed(futures):
+                yield future.result().get('results', [])
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def fetch_occurrences(species, year=None, country='NO', **kwargs):
+    """ Returns all occurrence records of a species (and year) as a list of dicts. """
+    records = []
+    for results in iter_pages(occurrence_params(species, year, country), **kwargs):
+        records.extend(results)
+    return records
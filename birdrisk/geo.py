@@ -0,0 +1,84 @@
+"""Geodesic helpers for the radar maps.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from pyproj import Geod
+
+GEOD = Geod(ellps='WGS84')
+RING_CACHE_SIZE = 4096
+# Metres per degree of latitude, a degree of longitude is shorter by cos(lat)
+METRES_PER_DEGREE = 111320.0
+
+_ring_cache = OrderedDict()
+_ring_lock = threading.Lock()
+
+
+def _compute_rings(keys, num_points):
+    """ Computes the rings of (lat, lon, radius_km) keys in one vectorized Geod.fwd call. """
+    centers = np.array(keys, dtype=np.float64)
+    azimuths = np.linspace(0, 360, num_points)
+    shape = (len(centers), num_points)
+    lat = np.broadcast_to(centers[:, 0:1], shape).ravel()
+    lon = np.broadcast_to(centers[:, 1:2], shape).ravel()
+    dist = np.broadcast_to(centers[:, 2:3] * 1000, shape).ravel()
+    az = np.broadcast_to(azimuths, shape).ravel()
+    ring_lon, ring_lat, _ = GEOD.fwd(lon, lat, az, dist)
+    return np.stack([ring_lat.reshape(shape), ring_lon.reshape(shape)], axis=-1)
+
+
+def range_rings(lats, lons, radii_km=(50,), num_points=100):
+    """ Returns the latitude and longitude points of circles around several central points.
+
+    The result has the shape (n_points, n_radii, num_points, 2) with latitude
+    and longitude in the last axis. Rings are cached by center, radius and
+    resolution; all rings missing from the cache are computed in one batch.
+    """
+    lats = np.asarray(lats, dtype=np.float64).ravel()
+    lons = np.asarray(lons, dtype=np.float64).ravel()
+    radii = np.atleast_1d(np.asarray(radii_km, dtype=np.float64))
+    keys = [(lat, lon, radius) for lat, lon in zip(lats.tolist(), lons.tolist()) for radius in radii.tolist()]
+
+    with _ring_lock:
+        missing = list(dict.fromkeys(key for key in keys if (key, num_points) not in _ring_cache))
+    if missing:
+        computed = _compute_rings(missing, num_points)
+        with _ring_lock:
+            for key, ring in zip(missing, computed):
+                _ring_cache[(key, num_points)] = ring
+            while len(_ring_cache) > RING_CACHE_SIZE:
+                _ring_cache.popitem(last=False)
+
+    rings = np.empty((len(keys), num_points, 2))
+    with _ring_lock:
+        for i, key in enumerate(keys):
+            ring = _ring_cache.get((key, num_points))
+            if ring is None:
+                # evicted by a concurrent call in the meantime
+                ring = _compute_rings([key], num_points)[0]
+            else:
+                _ring_cache.move_to_end((key, num_points))
+            rings[i] = ring
+    return rings.reshape(len(lats), len(radii), num_points, 2)
+
+
+def local_xyz(lon, lat, z, origin):
+    """ Returns the points in metres east, north and up of origin (lon, lat), equirectangular.
+
+    Accurate to a few metres over the tens of kilometres of a radar scene.
+    """
+    lon0, lat0 = origin
+    x = (np.asarray(lon, dtype=np.float64) - lon0) * METRES_PER_DEGREE * np.cos(np.radians(lat0))
+    y = (np.asarray(lat, dtype=np.float64) - lat0) * METRES_PER_DEGREE
+    return np.column_stack([x, y, np.asarray(z, dtype=np.float64)])
+
+
+def segment_distance(points, start, end):
+    """ Returns the distance of points to the segments start-end (rows of 3-D points). """
+    direction = end - start
+    length2 = (direction ** 2).sum(axis=1)
+    along = np.divide(((points - start) * direction).sum(axis=1), length2,
+                      out=np.zeros(len(points)), where=length2 > 0)
+    closest = start + np.clip(along, 0, 1)[:, None] * direction
+    return np.sqrt(((points - closest) ** 2).sum(axis=1))
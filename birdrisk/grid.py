@@ -0,0 +1,71 @@
+"""Dense time x height grids of VPTS values.
+"""
+import numpy as np
+
+# Default height bin width of the VPTS profiles in m
+HEIGHT_INTERVAL = 200
+# Default number of time columns sent to the browser
+MAX_COLUMNS = 1000
+
+
+def height_interval(heights):
+    """ Returns the height bin width of a profile, the smallest step between its bins. """
+    steps = np.diff(np.unique(np.asarray(heights)))
+    return float(steps.min()) if len(steps) else float(HEIGHT_INTERVAL)
+
+
+def time_step(times):
+    """ Returns the most common step between the unique times. """
+    steps = np.diff(np.unique(np.asarray(times)))
+    if not len(steps):
+        return np.timedelta64(5, 'm')
+    values, counts = np.unique(steps, return_counts=True)
+    return values[np.argmax(counts)]
+
+
+def density_grid(frame, value='dens', step=None):
+    """ Pivots long VPTS rows into a (time, height) array on a regular time axis.
+
+    Returns the times (UTC, as datetime64), the sorted heights and the values.
+    Time steps without a profile and cells missing in frame are NaN, so gaps
+    stay visible.
+    """
+    datetimes = frame['datetime']
+    if datetimes.dt.tz is not None:
+        datetimes = datetimes.dt.tz_convert('UTC').dt.tz_localize(None)
+    raw_times = datetimes.to_numpy()
+    step = step if step is not None else time_step(raw_times)
+    start = raw_times.min()
+    t_idx = np.rint((raw_times - start) / step).astype(np.int64)
+    heights, h_idx = np.unique(frame['height'].to_numpy(), return_inverse=True)
+
+    times = start + np.arange(t_idx.max() + 1) * step
+    values = np.full((len(times), len(heights)), np.nan, dtype=np.float32)
+    values[t_idx, h_idx.ravel()] = frame[value].to_numpy(np.float32)
+    return times, heights, values
+
+
+def downsample_grid(times, values, max_columns=MAX_COLUMNS):
+    """ Averages blocks of consecutive time steps so at most max_columns remain.
+
+    Returns the times of the block starts and the block means (NaN only where
+    a whole block is missing).
+    """
+    factor = int(np.ceil(len(times) / max_columns))
+    if factor <= 1:
+        return times, values
+    n_blocks = int(np.ceil(len(times) / factor))
+    padded = np.full((n_blocks * factor,) + values.shape[1:], np.nan, dtype=values.dtype)
+    padded[:len(values)] = values
+    blocks = padded.reshape((n_blocks, factor) + values.shape[1:])
+    valid = np.isfinite(blocks)
+    count = valid.sum(axis=1)
+    total = np.where(valid, blocks, 0).sum(axis=1)
+    means = np.divide(total, count, out=np.full(total.shape, np.nan, dtype=values.dtype), where=count > 0)
+    return times[::factor], means
+
+
+def grid_max(times, heights, values):
+    """ Returns the highest value of a grid and the time and height it occurs at. """
+    t_idx, h_idx = np.unravel_index(np.nanargmax(values), values.shape)
+    return values[t_idx, h_idx], times[t_idx], heights[h_idx]
@@ -0,0 +1,93 @@
+"""Counts of point observations on the H3 hexagonal grid.
+
+Cells are handled as 64 bit integers, so parents are derived with bit
+operations. All coordinates are indexed in one call when h3ronpy is
+installed, otherwise every distinct coordinate is indexed once with h3. Cell
+outlines are only built for occupied cells and only when a renderer needs
+polygons, pydeck's H3HexagonLayer draws the cells from their ids.
+"""
+import h3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+try:
+    from h3ronpy.vector import coordinates_to_cells
+except ImportError:  # h3ronpy not installed
+    coordinates_to_cells = None
+
+# Resolutions of the count pyramid, the finest one is indexed from the coordinates
+PYRAMID_RESOLUTIONS = range(3, 9)
+# Bit position of the resolution field of an H3 index and width of one cell digit
+_RES_SHIFT = 52
+_DIGIT_BITS = 3
+
+
+def latlng_to_cells(lats, lons, resolution):
+    """ Returns the H3 cells (uint64) of coordinates in degrees. """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if coordinates_to_cells is not None:
+        return pa.array(coordinates_to_cells(lats, lons, resolution)).to_numpy(zero_copy_only=False).astype(np.uint64)
+
+    # observations often share coordinates, each distinct one is indexed once
+    points, inverse = np.unique(np.column_stack([lats, lons]), axis=0, return_inverse=True)
+    cells = np.array([h3.str_to_int(h3.latlng_to_cell(lat, lon, resolution)) for lat, lon in points], dtype=np.uint64)
+    return cells[inverse.ravel()]
+
+
+def cell_parents(cells, resolution):
+    """ Returns the parents (uint64) of cells at a coarser resolution.
+
+    Sets the resolution field and marks the digits below it as unused (all
+    ones), which is what h3.cell_to_parent does.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    unused = np.uint64((1 << ((15 - resolution) * _DIGIT_BITS)) - 1)
+    res_field = np.uint64(0xF << _RES_SHIFT)
+    return (cells & ~res_field) | np.uint64(resolution << _RES_SHIFT) | unused
+
+
+def cell_counts(cells, weights=None):
+    """ Returns the occupied cells as H3 strings and their number of points (sum of weights), largest first. """
+    cells, inverse = np.unique(np.asarray(cells, dtype=np.uint64), return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=weights, minlength=len(cells))
+    if weights is None or np.issubdtype(np.asarray(weights).dtype, np.integer):
+        counts = counts.astype(np.int64)
+    result = pd.DataFrame({'hex_index': [h3.int_to_str(int(cell)) for cell in cells], 'counts': counts})
+    return result.sort_values('counts', ascending=False, kind='stable', ignore_index=True)
+
+
+def hex_counts(lats, lons, resolution=5):
+    """ Returns the number of points per occupied H3 cell (columns hex_index and counts). """
+    if not len(lats):
+        return pd.DataFrame({'hex_index': pd.Series(dtype=object), 'counts': pd.Series(dtype=np.int64)})
+    return cell_counts(latlng_to_cells(lats, lons, resolution))
+
+
+def hex_pyramid(lats, lons, resolutions=PYRAMID_RESOLUTIONS):
+    """ Returns the hex_counts tables of several resolutions keyed by resolution.
+
+    Only the finest resolution is indexed from the coordinates, the coarser
+    levels sum the counts of its occupied cells per parent. H3 children do not
+    tile their parent exactly, so a few points near cell edges end up in a
+    neighbour of the cell direct indexing would give.
+    """
+    resolutions = sorted(resolutions)
+    cells = latlng_to_cells(lats, lons, resolutions[-1]) if len(lats) else np.zeros(0, dtype=np.uint64)
+    fine, counts = np.unique(cells, return_counts=True)
+    return {resolution: cell_counts(cell_parents(fine, resolution), counts) for resolution in resolutions}
+
+
+def hex_geojson(counts):
+    """ Returns a GeoJSON FeatureCollection of the cells of a hex_counts table with their counts as properties. """
+    features = []
+    for hex_index, count in zip(counts['hex_index'], counts['counts']):
+        # h3 returns (lat, lng) pairs, GeoJSON rings are closed and in (lng, lat) order
+        ring = [[lon, lat] for lat, lon in h3.cell_to_boundary(hex_index)]
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [ring + ring[:1]]},
+            'properties': {'hex_index': hex_index, 'counts': int(count)},
+        })
+    return {'type': 'FeatureCollection', 'features': features}
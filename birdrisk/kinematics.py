@@ -0,0 +1,189 @@
+"""Kinematic features of radar tracks and a rule based behaviour classifier.
+
+Features are computed from the flat point arrays of a TrackSet: segment
+values (speed, climb rate, heading) come from differences of consecutive
+points and are reduced per track with reduceat/bincount, so there is no
+loop over tracks. Times at a height are integrated along the segments, the
+height is taken as linear in time between two points.
+"""
+import numpy as np
+import pandas as pd
+
+from birdrisk.geo import local_xyz
+
+# Top of the rotor swept area (m), the default turbine of the migration page
+ROTOR_HEIGHT = 200.0
+# Inner edges of the height bands (m); below the first, between and above the last edge
+HEIGHT_BANDS = (50.0, 100.0, 200.0)
+# Segments shorter than this (m) horizontally have no meaningful heading
+MIN_HEADING_STEP = 1.0
+# Behaviours in order of precedence, a track takes the first whose (min, max) ranges all hold
+BEHAVIOUR_RULES = (
+    ('soaring', {'turn_net_abs': (300.0, None), 'climb_rate_mean': (0.2, None)}),
+    ('foraging', {'sinuosity': (1.5, None), 'speed_mean': (None, 10.0)}),
+    ('transit', {'sinuosity': (None, 1.3), 'speed_mean': (6.0, None)}),
+)
+OTHER_BEHAVIOUR = 'other'
+
+
+def band_names(edges=HEIGHT_BANDS):
+    """ Returns the feature names of the time shares in the height bands. """
+    edges = [f'{edge:g}' for edge in edges]
+    return ([f'share_below_{edges[0]}'] + [f'share_{a}_{b}' for a, b in zip(edges[:-1], edges[1:])]
+            + [f'share_above_{edges[-1]}'])
+
+
+def time_below(low, high, duration, height):
+    """ Returns the time of segments between heights low and high (low <= high) spent below height. """
+    share = np.divide(height - low, high - low, out=(low < height).astype(np.float64), where=high > low)
+    return np.clip(share, 0, 1) * duration
+
+
+def group_quantiles(values, owner, groups, qs):
+    """ Returns the qs quantiles (linear) of values per owner, shape (len(qs), groups).
+
+    NaN values are left out and empty groups get NaN. All groups are sorted
+    at once by offsetting the values of every owner beyond those of the
+    previous ones.
+    """
+    valid = ~np.isnan(values)
+    values, owner = values[valid], owner[valid]
+    counts = np.bincount(owner, minlength=groups)
+    result = np.full((len(qs), groups), np.nan)
+    if not len(values):
+        return result
+    scale = 2 * np.abs(values).max() + 1
+    sorted_values = values[np.argsort(owner * scale + values)]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    has = counts > 0
+    for i, q in enumerate(qs):
+        position = starts[has] + q * (counts[has] - 1)
+        low, high = np.floor(position).astype(np.int64), np.ceil(position).astype(np.int64)
+        result[i, has] = sorted_values[low] + (position - low) * (sorted_values[high] - sorted_values[low])
+    return result
+
+
+def _group_reduce(ufunc, values, starts, has):
+    """ Reduces the segment values of the tracks starting at starts with ufunc, NaN where not has. """
+    result = np.full(len(starts), np.nan)
+    if has.any():
+        result[has] = ufunc.reduceat(values, starts[has])
+    return result
+
+
+def _group_mean(values, owner, groups):
+    valid = ~np.isnan(values)
+    total = np.bincount(owner, np.where(valid, values, 0), minlength=groups)
+    count = np.bincount(owner, valid, minlength=groups)
+    return np.divide(total, count, out=np.full(groups, np.nan), where=count > 0)
+
+
+def track_features(tracks, rotor_height=ROTOR_HEIGHT, bands=HEIGHT_BANDS):
+    """ Returns the kinematic features of every track of a TrackSet as a DataFrame, one row per track.
+
+    Distances are horizontal in m, speeds in m/s, climb rates in m/s (up
+    positive), angles in degrees and times in s. Segments without time
+    difference are left out of the speed and climb statistics; tracks with a
+    single point get NaN for everything but their height.
+    """
+    n = len(tracks)
+    lengths = tracks.lengths
+    origin = (float(np.nanmean(tracks.lon)), float(np.nanmean(tracks.lat))) if len(tracks.lon) else (0.0, 0.0)
+    xyz = local_xyz(tracks.lon, tracks.lat, tracks.z, origin)
+    t = tracks.t.astype(np.float64)
+
+    # segment i joins point i and i + 1; the segments across track ends get no
+    # length and no time, so they drop out of every sum, mean and extreme
+    owner = tracks.track_index[:-1]
+    boundary = np.zeros(len(owner), dtype=bool)
+    boundary[tracks.offsets[1:-1][tracks.offsets[1:-1] > 0] - 1] = True
+    step = np.diff(xyz, axis=0)
+    step[boundary] = 0
+    distance = np.hypot(step[:, 0], step[:, 1])
+    dt = np.diff(t)
+    dt[boundary] = 0
+    timed = dt > 0
+    speed = np.divide(distance, dt, out=np.full(len(dt), np.nan), where=timed)
+    climb = np.divide(step[:, 2], dt, out=np.full(len(dt), np.nan), where=timed)
+
+    first, last = tracks.offsets[:-1], tracks.offsets[1:] - 1
+    nonempty = lengths > 0
+    duration = np.full(n, np.nan)
+    duration[nonempty] = t[last[nonempty]] - t[first[nonempty]]
+    displacement = np.full(n, np.nan)
+    displacement[nonempty] = np.hypot(*(xyz[last[nonempty], :2] - xyz[first[nonempty], :2]).T)
+    net_climb = np.full(n, np.nan)
+    net_climb[nonempty] = xyz[last[nonempty], 2] - xyz[first[nonempty], 2]
+    path = np.bincount(owner, distance, minlength=n)
+    path[lengths < 2] = np.nan
+    speed_mean = np.divide(path, duration, out=np.full(n, np.nan), where=duration > 0)
+    median, p90 = group_quantiles(speed, owner, n, (0.5, 0.9))
+    speed_std = np.sqrt(np.clip(_group_mean(speed ** 2, owner, n) - _group_mean(speed, owner, n) ** 2, 0, None))
+
+    features = {
+        'points': lengths,
+        'duration': duration,
+        'path_length': path,
+        'displacement': displacement,
+        'sinuosity': np.divide(path, displacement, out=np.full(n, np.nan), where=displacement > 0),
+        'speed_mean': speed_mean,
+        'speed_median': median,
+        'speed_p90': p90,
+        'speed_max': _group_reduce(np.fmax, speed, first, lengths > 1),
+        'speed_cv': np.divide(speed_std, speed_mean, out=np.full(n, np.nan), where=speed_mean > 0),
+        'climb_rate_mean': np.divide(net_climb, duration, out=np.full(n, np.nan), where=duration > 0),
+        'climb_rate_max': _group_reduce(np.fmax, climb, first, lengths > 1),
+        'sink_rate_max': _group_reduce(np.fmin, climb, first, lengths > 1),
+    }
+
+    # turning angles between consecutive segments with a heading, wrapped to [-180, 180)
+    moving = np.flatnonzero(distance >= MIN_HEADING_STEP)
+    heading = np.degrees(np.arctan2(step[moving, 0], step[moving, 1]))
+    pair = owner[moving][:-1] == owner[moving][1:]
+    turn = (np.diff(heading)[pair] + 180) % 360 - 180
+    turn_owner = owner[moving][:-1][pair]
+    turns = np.bincount(turn_owner, minlength=n)
+    features['turn_mean'] = np.divide(np.bincount(turn_owner, np.abs(turn), minlength=n), turns,
+                                      out=np.full(n, np.nan), where=turns > 0)
+    features['turn_total'] = np.bincount(turn_owner, np.abs(turn), minlength=n)
+    features['turn_net_abs'] = np.abs(np.bincount(turn_owner, turn, minlength=n))
+
+    # time weighted heights: single point tracks keep the height of their point
+    z0, z1 = xyz[:-1, 2], xyz[1:, 2]
+    low, high = np.minimum(z0, z1), np.maximum(z0, z1)
+    flight_time = np.bincount(owner, dt, minlength=n)
+    height = np.divide(np.bincount(owner, (z0 + z1) / 2 * dt, minlength=n), flight_time,
+                       out=np.full(n, np.nan), where=flight_time > 0)
+    single = nonempty & (flight_time == 0)
+    height[single] = xyz[first[single], 2]
+    features['height_mean'] = height
+    below = np.bincount(owner, time_below(low, high, dt, rotor_height), minlength=n)
+    features['time_below_rotor'] = below
+    features['share_below_rotor'] = np.divide(below, flight_time, out=np.full(n, np.nan), where=flight_time > 0)
+    # the time in a band is the time below its upper edge less the time below its lower one
+    below_edges = [np.zeros(n)] + [np.bincount(owner, time_below(low, high, dt, edge), minlength=n) for edge in bands]
+    below_edges.append(flight_time)
+    for name, lower, upper in zip(band_names(bands), below_edges[:-1], below_edges[1:]):
+        features[name] = np.divide(upper - lower, flight_time, out=np.full(n, np.nan), where=flight_time > 0)
+
+    result = pd.DataFrame(features)
+    result.insert(0, 'id', tracks.table['id'].to_numpy())
+    return result
+
+
+def classify_behaviour(features, rules=BEHAVIOUR_RULES, other=OTHER_BEHAVIOUR):
+    """ Returns the behaviour of every row of track_features by the first matching rule, other if none. """
+    behaviour = np.full(len(features), other, dtype=object)
+    open_ = np.ones(len(features), dtype=bool)
+    for label, ranges in rules:
+        match = open_.copy()
+        for name, (low, high) in ranges.items():
+            values = features[name].to_numpy(np.float64)
+            if low is not None:
+                match &= values >= low
+            if high is not None:
+                match &= values <= high
+        behaviour[match] = label
+        open_ &= ~match
+    categories = list(dict.fromkeys([label for label, _ in rules] + [other]))
+    return pd.Series(pd.Categorical(behaviour, categories=categories), index=features.index, name='behaviour')
@@ -0,0 +1,60 @@
+"""Base of the local Parquet stores that are bounded in size.
+"""
+import os
+import threading
+
+import pyarrow.parquet as pq
+
+
+class LruStore:
+    """A folder of Parquet files kept below max_bytes by deleting the least recently used files.
+
+    Readers mark a file as used by setting its access time; files are written
+    to a temporary name first and swapped in, so concurrent readers never see
+    a partial file.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _write(self, path, table):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path) - old_size
+        self.evict()
+
+    def _files(self):
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.parquet'):
+                    yield os.path.join(folder, name)
+
+    def evict(self):
+        """ Deletes the least recently used files until the store fits into max_bytes. """
+        with self._lock:
+            if self._size is None:
+                self._size = sum(os.path.getsize(path) for path in self._files())
+            if self._size <= self.max_bytes:
+                return
+
+            entries = []
+            for path in self._files():
+                stat = os.stat(path)
+                entries.append((stat.st_atime, stat.st_size, path))
+            entries.sort()
+
+            self._size = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if self._size <= self.max_bytes:
+                    break
+                os.remove(path)
+                self._size -= size
@@ -0,0 +1,93 @@
+"""Plotly map layers with one trace per layer type.
+
+Instead of one trace per station, the geometries of all features of a layer
+are concatenated into a single trace (lines separated by None, polygons as
+one GeoJSON collection) and per-feature colours and hover texts are passed as
+arrays. The number of traces and the size of the figure stay constant when
+more stations are added.
+"""
+import numpy as np
+import plotly.graph_objs as go
+
+
+def _separated(starts, ends, gap=None):
+    """ Interleaves start and end coordinates with separators: s0, e0, None, s1, e1, None, ... """
+    coords = np.empty((len(starts), 3), dtype=object)
+    coords[:, 0] = list(starts)
+    coords[:, 1] = list(ends)
+    coords[:, 2] = gap
+    return coords.ravel().tolist()
+
+
+def _repeated(values, gap=None):
+    """ Repeats per-feature values for the start and end point of a segment. """
+    return _separated(values, values, gap)
+
+
+def ring_layer(rings, values, hover_text=None, colorscale='Greens', zmin=0, zmax=1, opacity=0.6, name='coverage'):
+    """ Returns one trace with all circles, filled by value on the colorscale.
+
+    rings is an array (n_features, num_points, 2) of latitude/longitude
+    vertices as returned by birdrisk.geo.range_rings for a single radius.
+    """
+    features = [{
+        'type': 'Feature',
+        'id': i,
+        'geometry': {'type': 'Polygon', 'coordinates': [np.round(ring[:, ::-1], 5).tolist()]},
+    } for i, ring in enumerate(rings)]
+    return go.Choroplethmapbox(
+        geojson={'type': 'FeatureCollection', 'features': features},
+        locations=list(range(len(features))),
+        z=np.asarray(values, dtype=np.float64),
+        zmin=zmin,
+        zmax=zmax,
+        colorscale=colorscale,
+        marker=dict(opacity=opacity, line=dict(width=2)),
+        text=hover_text,
+        hoverinfo='text' if hover_text is not None else 'skip',
+        showscale=False,
+        name=name,
+    )
+
+
+def arrow_layer(lats, lons, dlat, dlon, angles, color, hover_text=None, name=None):
+    """ Returns one trace with an arrow from every point (lat, lon) to (lat + dlat, lon + dlon). """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return go.Scattermapbox(
+        mode='markers+lines',
+        lat=_separated(lats, lats + np.asarray(dlat, dtype=np.float64)),
+        lon=_separated(lons, lons + np.asarray(dlon, dtype=np.float64)),
+        marker={'size': 10, 'symbol': "arrow-bar", 'angle': _repeated(np.asarray(angles, dtype=np.float64), gap=0)},
+        line=dict(width=2, color=color),
+        text=_repeated(hover_text) if hover_text is not None else None,
+        hoverinfo='text' if hover_text is not None else 'skip',
+        showlegend=False,
+        name=name,
+    )
+
+
+def station_layer(lats, lons, names, hover_text=None, color='#636efa', size=9, name='radar'):
+    """ Returns one marker trace for all stations. """
+    return go.Scattermapbox(
+        mode='markers',
+        lat=np.asarray(lats, dtype=np.float64),
+        lon=np.asarray(lons, dtype=np.float64),
+        marker=dict(size=size, color=color),
+        text=hover_text if hover_text is not None else list(names),
+        hoverinfo='text',
+        showlegend=False,
+        name=name,
+    )
+
+
+def map_figure(layers, lats, lons, zoom=3, height=500):
+    """ Returns an OpenStreetMap figure with the given layers centred on the stations. """
+    fig = go.Figure(data=list(layers))
+    fig.update_layout(
+        mapbox=dict(style="open-street-map", zoom=zoom,
+                    center=dict(lat=float(np.mean(lats)), lon=float(np.mean(lons)))),
+        margin={"r": 0, "t": 0, "l": 0, "b": 0},
+        height=height,
+    )
+    return fig
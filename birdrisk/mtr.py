@@ -0,0 +1,175 @@
+"""Migration traffic rate (MTR) and cumulative passage from VPTS profiles.
+
+The MTR of a height bin is the number of birds crossing a 1 km line
+perpendicular to their flight direction per hour: density (birds/km3) x
+ground speed (km/h) x bin thickness (km). Summed over the bins of a band it
+gives the MTR of the band, integrated over time it gives the passage
+(birds/km) of a night.
+
+All functions work on (radar, time, height) arrays. Times are kept as they
+are, so irregular timestamps and profiles missing for some radars are
+handled through per radar time weights instead of a regular time axis.
+"""
+import numpy as np
+import pandas as pd
+
+from birdrisk.exposure import band_overlap, swept_bands
+from birdrisk.grid import height_interval, time_step
+
+# A night runs from noon to noon UTC and is named after its first day
+NIGHT_OFFSET = pd.Timedelta(hours=12)
+# VPTS columns needed for the MTR
+MTR_COLUMNS = ('datetime', 'height', 'dens', 'ff', 'dd')
+
+
+def _sorted_codes(values):
+    """ Returns the sorted unique values and the index of each value into them, hashing instead of sorting all values. """
+    codes, uniques = pd.factorize(values)
+    order = np.argsort(uniques)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return uniques[order], rank[codes]
+
+
+def profile_array(frames, columns=('dens', 'ff', 'dd')):
+    """ Stacks long VPTS frames of several radars into (radar, time, height) arrays.
+
+    frames is a dict radar -> frame. The time axis is the sorted union of all
+    timestamps (UTC, as datetime64) and the height axis the union of all
+    heights. Returns radars, times, heights, a (radar, time) mask of the
+    profiles that exist and a dict of float32 arrays per column, NaN where a
+    profile or bin is missing.
+    """
+    frames = {radar: frame for radar, frame in frames.items() if frame is not None and not frame.empty}
+    radars = list(frames)
+    data = pd.concat(frames.values(), ignore_index=True) if frames else pd.DataFrame(columns=['datetime', 'height'])
+    r_idx = np.repeat(np.arange(len(radars)), [len(frame) for frame in frames.values()])
+
+    datetimes = pd.to_datetime(data['datetime'], utc=True).dt.tz_localize(None)
+    times, t_idx = _sorted_codes(datetimes.to_numpy())
+    heights, h_idx = _sorted_codes(data['height'].to_numpy())
+
+    present = np.zeros((len(radars), len(times)), dtype=bool)
+    present[r_idx, t_idx] = True
+    values = {}
+    for column in columns:
+        array = np.full((len(radars), len(times), len(heights)), np.nan, dtype=np.float32)
+        if column in data:
+            array[r_idx, t_idx, h_idx] = data[column].to_numpy(np.float32)
+        values[column] = array
+    return radars, times, heights, present, values
+
+
+def time_weights(times, present, max_gap=None):
+    """ Returns the duration in hours each profile stands for, shape (radar, time).
+
+    A profile covers half the interval to the previous and to the next profile
+    of the same radar. Each half is capped at max_gap / 2 (default twice the
+    median interval of the radar), so a single dropped profile is bridged but
+    longer outages are not integrated. The first and last profile get half the
+    median interval on their open side. Missing profiles get 0.
+    """
+    times = np.asarray(times, dtype='datetime64[s]')
+    hours = (times - times[0]).astype(np.float64) / 3600 if len(times) else np.zeros(0)
+    n_times = present.shape[-1]
+    idx = np.arange(n_times)
+
+    # index of the previous and the next existing profile of the same radar
+    last = np.maximum.accumulate(np.where(present, idx, -1), axis=-1)
+    prev = np.concatenate([np.full(present.shape[:-1] + (1,), -1), last[..., :-1]], axis=-1)
+    first = np.minimum.accumulate(np.where(present, idx, n_times)[..., ::-1], axis=-1)[..., ::-1]
+    nxt = np.concatenate([first[..., 1:], np.full(present.shape[:-1] + (1,), n_times)], axis=-1)
+    interval = np.where(present & (nxt < n_times), hours[np.clip(nxt, None, n_times - 1)] - hours, np.nan)
+
+    # usual time step per radar, the timestamps of different radars need not line up
+    counts = np.isfinite(interval).sum(axis=-1, keepdims=True)
+    step = np.sort(np.nan_to_num(interval, nan=np.inf), axis=-1)
+    step = np.take_along_axis(step, np.clip((counts - 1) // 2, 0, None), axis=-1)
+    step = np.where(counts > 0, step, time_step(times) / np.timedelta64(1, 'h') if len(times) > 1 else 5 / 60)
+    max_gap = 2 * step if max_gap is None else pd.Timedelta(max_gap) / pd.Timedelta(hours=1)
+
+    left = np.where(prev >= 0, (hours - hours[np.clip(prev, 0, None)]) / 2, step / 2)
+    right = np.where(nxt < n_times, interval / 2, step / 2)
+    weights = np.minimum(left, max_gap / 2) + np.minimum(right, max_gap / 2)
+    return np.where(present, weights, 0.0)
+
+
+def mtr_bins(dens, ff, heights, dd=None, toward=None, bin_width=None):
+    """ Returns the MTR (birds/km/h) of every height bin, same shape as dens.
+
+    dens is in birds/km3 and ff the ground speed in m/s, with the heights in the
+    last axis. With toward (degrees) and dd only the movement toward that
+    direction is counted, e.g. toward=180 for the southward autumn flux;
+    movement away from it is negative. Missing values count as 0.
+    """
+    bin_km = (bin_width or height_interval(heights)) / 1000
+    speed = np.asarray(ff, dtype=np.float64)
+    if toward is not None:
+        speed = speed * np.cos(np.radians(np.asarray(dd, dtype=np.float64) - toward))
+    return np.nan_to_num(np.asarray(dens, dtype=np.float64) * speed * 3.6 * bin_km)
+
+
+def band_mtr(mtr, heights, lower, upper, bin_width=None):
+    """ Sums the bin MTR over height bands, e.g. the swept bands of turbines.
+
+    Bins partly inside a band contribute their overlapping share. Returns the
+    leading axes of mtr with the bands in the last axis.
+    """
+    bin_width = bin_width or height_interval(heights)
+    share = band_overlap(heights, np.atleast_1d(lower), np.atleast_1d(upper), bin_width) / bin_width
+    return mtr @ share.T
+
+
+def night_index(times):
+    """ Returns the nights of the times (named after their first day) and the index of each time into them. """
+    nights = (pd.DatetimeIndex(times) - NIGHT_OFFSET).date
+    return np.unique(nights, return_inverse=True)
+
+
+def passage(mtr, times, present, max_gap=None):
+    """ Integrates an MTR array (radar, time, ...) over each night.
+
+    Returns the nights, the passage in birds/km with shape (radar, night, ...)
+    and the hours covered by profiles per radar and night.
+    """
+    weights = time_weights(times, present, max_gap)
+    nights, n_idx = night_index(times)
+    one_hot = (n_idx.ravel()[:, None] == np.arange(len(nights))).astype(np.float64)
+    weighted = mtr * weights.reshape(weights.shape + (1,) * (mtr.ndim - 2))
+    return nights, np.moveaxis(np.tensordot(weighted, one_hot, axes=([1], [0])), -1, 1), weights @ one_hot
+
+
+def nightly_passage(frames, turbines=None, toward=None, max_gap=None):
+    """ Computes the passage per radar and night from a dict radar -> VPTS frame.
+
+    Frames need the columns of MTR_COLUMNS (dd only with toward). Returns a
+    frame with the radar, night, passage (birds/km over the whole profile),
+    peak MTR (birds/km/h) and the hours covered. With turbines there is one
+    row per turbine as well, with the passage within its swept band.
+    """
+    radars, times, heights, present, values = profile_array(frames)
+    if not radars:
+        return pd.DataFrame(columns=['radar', 'night', 'passage', 'peak_mtr', 'hours'])
+    bins = mtr_bins(values['dens'], values['ff'], heights, values['dd'], toward)
+    column = bins.sum(axis=-1)
+    nights, total, hours = passage(column, times, present, max_gap)
+    nights_of_times = night_index(times)[1].ravel()
+    peak = np.zeros_like(total)
+    np.maximum.at(peak, (slice(None), nights_of_times), np.where(present, column, 0))
+
+    result = pd.DataFrame({
+        'radar': np.repeat(radars, len(nights)),
+        'night': np.tile(nights, len(radars)),
+        'passage': total.ravel(),
+        'peak_mtr': peak.ravel(),
+        'hours': hours.ravel(),
+    })
+    if turbines is None:
+        return result
+
+    lower, upper = swept_bands(turbines)
+    _, swept, _ = passage(band_mtr(bins, heights, lower, upper), times, present, max_gap)
+    result = result.loc[result.index.repeat(len(turbines))].reset_index(drop=True)
+    result.insert(2, 'turbine', np.tile(np.arange(len(turbines)), len(radars) * len(nights)))
+    result['swept_passage'] = swept.ravel()
+    return result
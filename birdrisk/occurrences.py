@@ -0,0 +1,175 @@
+"""Persistent local store of GBIF occurrences, one Parquet file per species and year.
+
+Only the fields the stopover page uses are kept. A stored year is refreshed
+incrementally: GBIF is asked only for the records interpreted since the last
+sync and these replace the stored records with the same key.
+
+Warm up the store for the stopover species, e.g.
+
+    python -m birdrisk.occurrences 2010 2024
+"""
+import argparse
+import os
+import time
+from datetime import date as date_cls, datetime, timedelta, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from birdrisk import CACHE_DIR
+from birdrisk.gbif import MAX_WORKERS, iter_pages, occurrence_params
+from birdrisk.lru import LruStore
+
+# Species shown on the stopover page
+STOPOVER_SPECIES = (
+    "Anser fabalis",
+    "Numenius phaeopus",
+    "Lymnocryptes minimus",
+    "Tachybaptus ruficollis",
+    "Gavia adamsii",
+)
+OCCURRENCE_FIELDS = ('key', 'scientificName', 'decimalLatitude', 'decimalLongitude', 'country', 'year',
+                     'eventDate', 'image_url')
+SYNC_KEY = b'birdrisk.synced'
+
+
+def image_url(record):
+    """ Returns the URL of the last still image of an occurrence record, if any. """
+    url = None
+    for item in record.get('media') or []:
+        if item.get('type') == 'StillImage':
+            url = item.get('identifier')
+    return url
+
+
+def occurrence_frame(records):
+    """ Returns the stored fields of GBIF occurrence records as a DataFrame. """
+    frame = pd.DataFrame({
+        field: [image_url(record) if field == 'image_url' else record.get(field) for record in records]
+        for field in OCCURRENCE_FIELDS
+    })
+    return frame.astype({'key': 'int64', 'decimalLatitude': 'float64', 'decimalLongitude': 'float64',
+                         'year': 'Int64', 'scientificName': 'string', 'country': 'string',
+                         'eventDate': 'string', 'image_url': 'string'})
+
+
+class OccurrenceStore(LruStore):
+    """GBIF occurrences of the stopover page, keyed by species and year.
+
+    Stored years are served without network access until they are older than
+    ttl (past_ttl for years before the current one, as they rarely change),
+    then refreshed incrementally. The modification time of a file records
+    its last sync check, its access time when it was last read, and the
+    store is kept below max_bytes by evicting the least recently used files.
+    """
+
+    def __init__(self, root=None, max_bytes=512 * 1024 ** 2, ttl=timedelta(days=1), past_ttl=timedelta(days=30)):
+        super().__init__(root or os.path.join(CACHE_DIR, 'gbif'), max_bytes)
+        self.ttl = ttl
+        self.past_ttl = past_ttl
+
+    def path(self, species, year):
+        return os.path.join(self.root, f"species={species.replace(' ', '_')}", f'year={year}.parquet')
+
+    def exists(self, species, year):
+        return os.path.exists(self.path(species, year))
+
+    def is_fresh(self, species, year):
+        try:
+            checked = os.stat(self.path(species, year)).st_mtime
+        except FileNotFoundError:
+            return False
+        ttl = self.past_ttl if year < date_cls.today().year else self.ttl
+        return time.time() - checked < ttl.total_seconds()
+
+    def synced(self, species, year):
+        """ Returns the UTC time the stored records were last synced with GBIF. """
+        metadata = pq.read_schema(self.path(species, year)).metadata or {}
+        synced = metadata.get(SYNC_KEY)
+        return datetime.fromisoformat(synced.decode()) if synced else None
+
+    def load(self, species, year):
+        path = self.path(species, year)
+        frame = pq.read_table(path).to_pandas()
+        # keep the sync check time, only mark the file as recently used
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+        return frame
+
+    def save(self, species, year, frame, synced):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), SYNC_KEY: synced.isoformat().encode()})
+        self._write(self.path(species, year), table)
+
+    def sync(self, species, year, country='NO', force=False, **fetch_kwargs):
+        """ Returns the occurrences of a species and year, downloading only what changed since the last sync.
+
+        fetch_kwargs are passed to iter_pages. Records deleted upstream stay in
+        the store until it is cleared.
+        """
+        stored = None
+        if self.exists(species, year):
+            if self.is_fresh(species, year) and not force:
+                return self.load(species, year)
+            stored = self.load(species, year)
+
+        params = occurrence_params(species, year, country)
+        since = self.synced(species, year) if stored is not None else None
+        if since:
+            # GBIF filters on whole days, records of the sync day are downloaded again and replaced by key
+            params['lastInterpreted'] = f'{since:%Y-%m-%d},*'
+        started = datetime.now(timezone.utc)
+        records = [record for results in iter_pages(params, **fetch_kwargs) for record in results]
+        frame = occurrence_frame(records)
+        if since:
+            frame = pd.concat([stored[~stored['key'].isin(frame['key'])], frame], ignore_index=True)
+        self.save(species, year, frame, started)
+        return frame
+
+
+def warm_up(store, species, years, country='NO', force=False, progress=None, **fetch_kwargs):
+    """ Syncs every species and year into the store, one after the other.
+
+    Pages of a single species and year are already fetched in parallel, so
+    GBIF is not hit by several searches at once. Returns the errors keyed by
+    (species, year); progress is called with the number of synced entries and
+    the total.
+    """
+    tasks = [(name, year) for name in species for year in years]
+    errors = {}
+    for done, (name, year) in enumerate(tasks, start=1):
+        try:
+            store.sync(name, year, country, force, **fetch_kwargs)
+        except Exception as e:
+            errors[(name, year)] = e
+        if progress:
+            progress(done, len(tasks))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm up the local GBIF occurrence store.")
+    parser.add_argument('start', type=int, help="first year")
+    parser.add_argument('end', type=int, help="last year")
+    parser.add_argument('--species', action='append',
+                        help="scientific name, can be repeated (default: the species of the stopover page)")
+    parser.add_argument('--country', default='NO', help="publishing country")
+    parser.add_argument('--cache-dir', default=None, help="root of the local GBIF store")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--force', action='store_true', help="sync even if the stored years are fresh")
+    args = parser.parse_args()
+
+    store = OccurrenceStore(root=args.cache_dir)
+
+    def progress(done, total):
+        print(f"\r{done}/{total} species and years", end='', flush=True)
+
+    errors = warm_up(store, args.species or STOPOVER_SPECIES, range(args.start, args.end + 1), args.country,
+                     args.force, progress, max_workers=args.workers)
+    print()
+    for (name, year), error in sorted(errors.items()):
+        print(f"{name} {year}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Analytical query backends for the VPTS data.
+
+The aggregations of the pages are written once as SQL and pushed down to the
+engine holding the raw profiles, so only the aggregated rows travel back, as
+Arrow tables. BigQueryBackend runs them in production, DuckDBBackend on the
+local Parquet store (VptsCache, radar site snapshot) for development and tests
+without network access. The VPTS source of a query is narrowed to one radar
+and the years it covers, so DuckDB only opens the files of those folders.
+"""
+import glob
+import os
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime, time, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from birdrisk import CACHE_DIR
+from birdrisk.exposure import band_overlap
+from birdrisk.grid import height_interval
+from birdrisk.radar_sites import RADAR_SITES_TABLE, SNAPSHOT_PATH
+
+_PARAM = re.compile(r'@(\w+)')
+
+
+def _quote(text):
+    """ Returns text as a SQL string literal. """
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _day_start(date):
+    return datetime.combine(date, time(), tzinfo=timezone.utc)
+
+
+class QueryBackend(ABC):
+    """Shared aggregation queries, subclasses provide the table sources and run the SQL.
+
+    Parameters are written as @name in the SQL.
+    """
+
+    @abstractmethod
+    def vpts_source(self, radar, years):
+        """ Returns the FROM clause of the VPTS rows, it holds at least the rows of radar in years. """
+
+    @abstractmethod
+    def sites_source(self):
+        """ Returns the FROM clause of the radar sites. """
+
+    @abstractmethod
+    def in_list(self, expression, name):
+        """ Returns the condition that expression is one of the values of the array parameter name. """
+
+    @abstractmethod
+    def query(self, sql, params=None):
+        """ Runs sql and returns the result as a DataFrame converted from Arrow. """
+
+    def radar_sites(self):
+        return self.query(f"""SELECT * FROM {self.sites_source()}""")
+
+    def daily_sums(self, radar, start, end):
+        """ Returns the summed density and the number of valid profile bins per day from start to end. """
+        sql = f"""
+            SELECT CAST(datetime AS DATE) AS date, SUM(dens) AS dens, COUNT(dens) AS n
+            FROM {self.vpts_source(radar, range(start.year, end.year + 1))}
+            WHERE radar = @radar AND datetime >= @start AND datetime < @end
+            GROUP BY date
+            ORDER BY date
+        """
+        return self.query(sql, {'radar': radar, 'start': _day_start(start),
+                                'end': _day_start(end + timedelta(days=1))})
+
+    def swept_fraction(self, radar, start, end, lower, upper, bin_width=None):
+        """ Returns per day the density within the height band [lower, upper) m above sea level, the total and their share.
+
+        The density is summed per day and height bin in one pass over the
+        rows, the bins are then weighted by their overlap with the band with
+        birdrisk.exposure.band_overlap, which infers the bin width from the
+        profile heights unless given.
+        """
+        sql = f"""
+            SELECT CAST(datetime AS DATE) AS date, height, SUM(dens) AS dens
+            FROM {self.vpts_source(radar, range(start.year, end.year + 1))}
+            WHERE radar = @radar AND datetime >= @start AND datetime < @end
+            GROUP BY date, height
+        """
+        sums = self.query(sql, {'radar': radar, 'start': _day_start(start),
+                                'end': _day_start(end + timedelta(days=1))})
+        sums = sums.pivot(index='date', columns='height', values='dens').sort_index()
+        heights = sums.columns.to_numpy(np.float64)
+        bin_width = bin_width or height_interval(heights)
+        dens = sums.to_numpy(np.float64)
+        result = pd.DataFrame({'date': sums.index})
+        result['swept'] = np.nansum(dens * band_overlap(heights, [lower], [upper], bin_width)[0] / bin_width, axis=1)
+        result['total'] = np.nansum(dens, axis=1)
+        result['fraction'] = result['swept'] / result['total'].where(result['total'] != 0)
+        return result
+
+    def multi_year_mean(self, radar, dates, time_bin_minutes=15):
+        """ Returns the mean density per time of day (tbin, minutes since midnight) over the given dates. """
+        sql = f"""
+            SELECT CAST(FLOOR((EXTRACT(HOUR FROM datetime) * 60 + EXTRACT(MINUTE FROM datetime)) / @bin)
+                        * @bin AS INT64) AS tbin,
+                   AVG(dens) AS dens
+            FROM {self.vpts_source(radar, sorted({date.year for date in dates}))}
+            WHERE radar = @radar AND {self.in_list('CAST(datetime AS DATE)', 'dates')}
+            GROUP BY tbin
+            ORDER BY tbin
+        """
+        return self.query(sql, {'radar': radar, 'dates': list(dates), 'bin': time_bin_minutes})
+
+
+class BigQueryBackend(QueryBackend):
+    """Runs the queries in BigQuery, vpts_table holds the VPTS rows with the columns of VPTS_SCHEMA."""
+
+    def __init__(self, client, vpts_table, sites_table=RADAR_SITES_TABLE):
+        self.client = client
+        self.vpts_table = vpts_table
+        self.sites_table = sites_table
+
+    def vpts_source(self, radar, years):
+        # the table is filtered by the WHERE clause, BigQuery prunes its partitions itself
+        return f'`{self.vpts_table}`'
+
+    def sites_source(self):
+        return f'`{self.sites_table}`'
+
+    def in_list(self, expression, name):
+        return f'{expression} IN UNNEST(@{name})'
+
+    @staticmethod
+    def _parameter(name, value):
+        from google.cloud import bigquery
+
+        def bq_type(v):
+            if isinstance(v, bool):
+                return 'BOOL'
+            if isinstance(v, int):
+                return 'INT64'
+            if isinstance(v, float):
+                return 'FLOAT64'
+            if isinstance(v, datetime):
+                return 'TIMESTAMP'
+            if hasattr(v, 'isoformat'):
+                return 'DATE'
+            return 'STRING'
+
+        if isinstance(value, (list, tuple)):
+            return bigquery.ArrayQueryParameter(name, bq_type(value[0]) if value else 'STRING', list(value))
+        return bigquery.ScalarQueryParameter(name, bq_type(value), value)
+
+    def query(self, sql, params=None):
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[self._parameter(name, value) for name, value in (params or {}).items()])
+        return self.client.query(sql, job_config=job_config).to_arrow().to_pandas()
+
+
+class DuckDBBackend(QueryBackend):
+    """Runs the queries with DuckDB on the local Parquet files."""
+
+    def __init__(self, vpts_root=None, sites_path=SNAPSHOT_PATH, connection=None):
+        import duckdb
+
+        self.vpts_root = vpts_root or os.path.join(CACHE_DIR, 'vpts')
+        self.sites_path = sites_path
+        self.connection = connection or duckdb.connect()
+        self.connection.execute("SET TimeZone = 'UTC'")
+
+    def vpts_source(self, radar, years):
+        # the store is laid out as <radar>/<year>/<file>, only the folders of the query are read
+        patterns = [os.path.join(self.vpts_root, radar, str(year), '*.parquet') for year in years]
+        patterns = [_quote(pattern) for pattern in patterns if glob.glob(pattern)]
+        if not patterns:
+            # read_parquet fails on a pattern without files, an empty store has no rows
+            return ("(SELECT NULL::VARCHAR AS radar, NULL::TIMESTAMPTZ AS datetime, NULL::SMALLINT AS height, "
+                    "NULL::FLOAT AS ff, NULL::FLOAT AS dd, NULL::FLOAT AS dens WHERE false)")
+        return f"read_parquet([{', '.join(patterns)}])"
+
+    def sites_source(self):
+        return f"read_parquet({_quote(self.sites_path)})"
+
+    def in_list(self, expression, name):
+        return f'list_contains(@{name}, {expression})'
+
+    def query(self, sql, params=None):
+        sql = _PARAM.sub(r'$\1', sql)
+        result = self.connection.execute(sql, params or {})
+        to_arrow = getattr(result, 'to_arrow_table', None) or result.fetch_arrow_table
+        return to_arrow().to_pandas()
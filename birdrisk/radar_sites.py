@@ -0,0 +1,114 @@
+"""Registry of the weather radar sites of the radar_sites table.
+
+The table is read from BigQuery once and mirrored to a local Parquet snapshot,
+which is used when BigQuery can not be reached (cold starts without
+credentials, offline tests). Spatial queries run on a haversine BallTree. The
+pages share one registry through get_radar_registry, streamlit is only
+imported when it is called.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from birdrisk import CACHE_DIR
+
+RADAR_SITES_TABLE = 'visavis-312202.wp4_dev.radar_sites'
+SNAPSHOT_PATH = os.path.join(CACHE_DIR, 'radar_sites.parquet')
+EARTH_RADIUS_KM = 6371.0088
+
+
+def bigquery_client(service_account_info):
+    """ Returns a BigQuery client for a service account, e.g. st.secrets["gcp_service_account"]. """
+    from google.cloud import bigquery
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_info(service_account_info)
+    return bigquery.Client(credentials=credentials)
+
+
+def query_radar_sites(client):
+    sql = f"""SELECT * FROM `{RADAR_SITES_TABLE}`"""
+    return client.query(sql).to_arrow().to_pandas()
+
+
+class RadarRegistry:
+    """The radar sites with nearest neighbour and radius queries.
+
+    Usage:
+        registry = load_registry(lambda: bigquery_client(st.secrets["gcp_service_account"]))
+        registry.nearest(58.1, 6.6, k=3)
+        registry.within(58.1, 6.6, radius_km=200)
+    """
+
+    def __init__(self, sites):
+        self.sites = sites.reset_index(drop=True)
+        coords = np.radians(self.sites[['latitude', 'longitude']].to_numpy(np.float64))
+        self._tree = BallTree(coords, metric='haversine')
+
+    def __len__(self):
+        return len(self.sites)
+
+    def site(self, radar):
+        """ Returns the row of a radar. """
+        return self.sites.loc[self.sites['radar'] == radar].iloc[0]
+
+    def _result(self, idx, dist):
+        result = self.sites.iloc[idx].copy()
+        result['distance_km'] = dist * EARTH_RADIUS_KM
+        return result
+
+    def nearest(self, lat, lon, k=1):
+        """ Returns the k radars closest to a point with their distance in km. """
+        k = min(k, len(self.sites))
+        dist, idx = self._tree.query(np.radians([[lat, lon]]), k=k)
+        return self._result(idx[0], dist[0])
+
+    def within(self, lat, lon, radius_km):
+        """ Returns the radars within radius_km of a point, closest first. """
+        idx, dist = self._tree.query_radius(np.radians([[lat, lon]]), r=radius_km / EARTH_RADIUS_KM,
+                                            return_distance=True, sort_results=True)
+        return self._result(idx[0], dist[0])
+
+
+def load_registry(client_factory=None, snapshot_path=SNAPSHOT_PATH):
+    """ Loads the radar sites from BigQuery and refreshes the local snapshot.
+
+    client_factory is only called here, so the credentials and the client are
+    created once per load. If it is None or the query fails, the snapshot is used.
+    """
+    error = None
+    if client_factory is not None:
+        try:
+            sites = query_radar_sites(client_factory())
+        except Exception as e:
+            error = e
+        else:
+            os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+            tmp_path = f'{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            sites.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, snapshot_path)
+            return RadarRegistry(sites)
+
+    if not os.path.exists(snapshot_path):
+        raise RuntimeError(f"Radar sites unavailable: no snapshot at {snapshot_path}") from error
+    return RadarRegistry(pd.read_parquet(snapshot_path))
+
+
+_cached_registry = None
+
+
+def get_radar_registry():
+    """ Returns the registry of the pages, loaded from BigQuery once per hour and shared by all sessions and pages. """
+    global _cached_registry
+    import streamlit as st
+
+    if _cached_registry is None:
+        @st.cache_resource(ttl=3600)
+        def cached_registry():
+            return load_registry(lambda: bigquery_client(st.secrets["gcp_service_account"]))
+
+        _cached_registry = cached_registry
+    return _cached_registry()
@@ -0,0 +1,180 @@
+"""Streaming aggregation of VPTS over a date range.
+
+Days are fetched a chunk at a time and folded into running totals right away,
+so memory does not grow with the length of the range: only one chunk of raw
+profiles is held at a time, the aggregates are per night and per height bin.
+The time x height heatmap of the range is a fixed number of time blocks, each
+day is folded into the running block means as it arrives.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from birdrisk.exposure import swept_exposure
+from birdrisk.grid import MAX_COLUMNS, density_grid, height_interval, time_step
+from birdrisk.mtr import NIGHT_OFFSET, nightly_passage
+from birdrisk.vpts import fetch_vpts
+
+
+def date_range(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def iter_days(radar, start, end, chunk_days=7, **fetch_kwargs):
+    """ Yields (date, frame) for every day from start to end, frame is None for days that could not be loaded.
+
+    Each chunk of chunk_days days is downloaded concurrently with fetch_vpts.
+    """
+    dates = date_range(start, end)
+    for i in range(0, len(dates), chunk_days):
+        chunk = dates[i:i + chunk_days]
+        frames, _ = fetch_vpts(radar, chunk, **fetch_kwargs)
+        for date in chunk:
+            yield date, frames.pop(date, None)
+
+
+class SeasonAggregator:
+    """Running totals of a range of VPTS days.
+
+    Collects the vertically integrated density (birds/km2) summed per night,
+    the mean density per height bin, the passage (birds/km) per night if the
+    frames have ground speeds and, if turbines are given, the density and
+    passage within their swept bands. With the first and last day of the
+    range the density is also averaged into at most max_columns time blocks
+    for the heatmap of the range.
+    """
+
+    def __init__(self, turbines=None, start=None, end=None, max_columns=MAX_COLUMNS):
+        self.turbines = turbines
+        self.start = start
+        self.end = end
+        self.max_columns = max_columns
+        self.block = None
+        self.grid_heights = np.zeros(0)
+        self.grid_sum = None
+        self.grid_count = None
+        self.nights = {}
+        self.height_sum = pd.Series(dtype=np.float64)
+        self.height_count = pd.Series(dtype=np.float64)
+        self.swept_density = None
+        self.total_density = 0.0
+        self.passage = {}
+        self.days = []
+        self.missing = []
+
+    def add(self, date, frame):
+        if frame is None or frame.empty:
+            self.missing.append(date)
+            return
+        self.days.append(date)
+
+        times, heights, grid = density_grid(frame)
+        self._add_grid(times, heights, grid)
+        bin_km = height_interval(heights) / 1000
+        column = np.nansum(grid, axis=1) * bin_km
+
+        nights = (pd.DatetimeIndex(times) - NIGHT_OFFSET).date
+        for night, value in pd.Series(column).groupby(nights).sum().items():
+            self.nights[night] = self.nights.get(night, 0.0) + value
+
+        valid = np.isfinite(grid)
+        self.height_sum = self.height_sum.add(pd.Series(np.where(valid, grid, 0).sum(axis=0), index=heights), fill_value=0)
+        self.height_count = self.height_count.add(pd.Series(valid.sum(axis=0), index=heights), fill_value=0)
+
+        if self.turbines is not None:
+            exposure = swept_exposure(grid, heights, self.turbines, sum_axes=0)
+            self.swept_density = exposure['density'] if self.swept_density is None else self.swept_density + exposure['density']
+            self.total_density += exposure['total']
+
+        if 'ff' in frame:
+            # a night spans two days, its passage is summed over both
+            columns = ['passage', 'swept_passage'] if self.turbines is not None else ['passage']
+            nights = nightly_passage({date: frame}, self.turbines)
+            for night, values in nights.groupby('night')[columns]:
+                values = values.to_numpy()
+                self.passage[night] = self.passage[night] + values if night in self.passage else values
+
+    def nightly_totals(self):
+        """ Returns the integrated density per night in birds/km2. """
+        totals = pd.Series(self.nights, dtype=np.float64).sort_index()
+        return totals.rename_axis('night').reset_index(name='dens')
+
+    def passage_totals(self):
+        """ Returns the passage per night in birds/km, and within the swept band of the first turbine. """
+        nights = sorted(self.passage)
+        result = pd.DataFrame({'night': nights, 'passage': [self.passage[night][0, 0] for night in nights]})
+        if self.turbines is not None:
+            result['swept_passage'] = [self.passage[night][0, 1] for night in nights]
+        return result
+
+    def peak_nights(self, n=5):
+        return self.nightly_totals().nlargest(n, 'dens')
+
+    def height_profile(self):
+        """ Returns the mean density per height bin over the whole range. """
+        mean = self.height_sum / self.height_count.where(self.height_count > 0)
+        return mean.rename_axis('height').reset_index(name='dens')
+
+    def _add_grid(self, times, heights, grid):
+        """ Adds the valid cells of a day grid to the sums and counts of their time block and height. """
+        if self.start is None or self.end is None:
+            return
+        if self.block is None:
+            # the block length follows from the time step of the first day and the length of the range
+            step = time_step(times)
+            steps = int(np.ceil(np.timedelta64((self.end - self.start).days + 1, 'D') / step))
+            factor = max(int(np.ceil(steps / self.max_columns)), 1)
+            self.block = step * factor
+            self.grid_sum = np.zeros((int(np.ceil(steps / factor)), 0))
+            self.grid_count = np.zeros((len(self.grid_sum), 0))
+        if len(np.setdiff1d(heights, self.grid_heights)):
+            merged = np.union1d(self.grid_heights, heights)
+            columns = np.searchsorted(merged, self.grid_heights)
+            for name in ('grid_sum', 'grid_count'):
+                wider = np.zeros((len(self.grid_sum), len(merged)))
+                wider[:, columns] = getattr(self, name)
+                setattr(self, name, wider)
+            self.grid_heights = merged
+
+        block = (times - np.datetime64(self.start, 'D')) // self.block
+        rows, cols = np.nonzero(np.isfinite(grid) & ((block >= 0) & (block < len(self.grid_sum)))[:, None])
+        cell = block[rows] * len(self.grid_heights) + np.searchsorted(self.grid_heights, heights)[cols]
+        self.grid_sum += np.bincount(cell, grid[rows, cols], minlength=self.grid_sum.size).reshape(self.grid_sum.shape)
+        self.grid_count += np.bincount(cell, minlength=self.grid_sum.size).reshape(self.grid_sum.shape)
+
+    def range_grid(self):
+        """ Returns the mean density per time block and height of the range (block start times, heights, values).
+
+        Blocks and heights without any valid value are NaN, the range has at
+        most max_columns blocks.
+        """
+        if self.grid_sum is None:
+            return np.array([], dtype='datetime64[ns]'), np.array([]), np.zeros((0, 0), dtype=np.float32)
+        times = np.datetime64(self.start, 'D') + np.arange(len(self.grid_sum)) * self.block
+        values = np.divide(self.grid_sum, self.grid_count, out=np.full(self.grid_sum.shape, np.nan),
+                           where=self.grid_count > 0)
+        return times, self.grid_heights, values.astype(np.float32)
+
+    def exposure(self):
+        """ Returns the turbine table with the density within the swept band and its share over the whole range. """
+        if self.turbines is None or self.swept_density is None:
+            return None
+        result = self.turbines.copy()
+        result['density'] = self.swept_density
+        result['fraction'] = self.swept_density / self.total_density if self.total_density > 0 else np.nan
+        return result
+
+
+def aggregate_season(radar, start, end, turbines=None, chunk_days=7, progress=None, **fetch_kwargs):
+    """ Streams all days from start to end through a SeasonAggregator.
+
+    progress is called with the number of processed days and the total.
+    """
+    aggregator = SeasonAggregator(turbines, start, end)
+    total = (end - start).days + 1
+    for done, (date, frame) in enumerate(iter_days(radar, start, end, chunk_days, **fetch_kwargs), start=1):
+        aggregator.add(date, frame)
+        if progress:
+            progress(done, total)
+    return aggregator
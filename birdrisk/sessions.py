@@ -0,0 +1,32 @@
+"""Process wide HTTP sessions, one keep-alive connection pool per remote service.
+
+Sessions are looked up by a pool name, e.g. 'aloftdata' or 'gbif', so all
+downloads from one service share their connections. The pool of a session
+grows to the largest pool_size any caller asked for.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 8
+
+_sessions = {}
+_pool_sizes = {}
+_lock = threading.Lock()
+
+
+def get_session(name, pool_size=DEFAULT_POOL_SIZE):
+    """ Returns the session of a pool name with room for at least pool_size concurrent connections. """
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = requests.Session()
+            _pool_sizes[name] = 0
+        if pool_size > _pool_sizes[name]:
+            # requests in flight finish on the old adapter, new ones use the larger pool
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _pool_sizes[name] = pool_size
+    return session
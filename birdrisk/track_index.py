@@ -0,0 +1,129 @@
+"""Spatio-temporal index over radar tracks.
+
+The bounding boxes of all tracks go into an STR-tree, their time spans,
+height ranges, species and classification ids into plain arrays. A query
+takes the tracks whose box meets the area from the tree, narrows them with
+the array filters and only then tests the track segments of the remaining
+candidates against the area and the height band.
+"""
+import numpy as np
+import shapely
+
+
+class TrackIndex:
+    """Answers which tracks of a TrackSet cross an area within a time window and height band.
+
+    Spatial queries use the tree, so the cost grows with the number of
+    candidate tracks, not with the size of the season.
+    """
+
+    def __init__(self, tracks):
+        self.tracks = tracks
+        metadata = tracks.metadata()
+        starts = tracks.offsets[:-1]
+        self.nonempty = tracks.lengths > 0
+        starts = starts[self.nonempty]
+
+        # per track extent of the points, empty tracks keep NaN and never match
+        extent = np.full((len(tracks), 6), np.nan)
+        for i, values in enumerate((tracks.lon, tracks.lat, tracks.z)):
+            extent[self.nonempty, 2 * i] = np.minimum.reduceat(values, starts)
+            extent[self.nonempty, 2 * i + 1] = np.maximum.reduceat(values, starts)
+        self.lon_min, self.lon_max, self.lat_min, self.lat_max, self.z_min, self.z_max = extent.T
+
+        self.start = metadata['timestamp_start'].to_numpy('datetime64[ms]')
+        self.end = metadata['timestamp_end'].to_numpy('datetime64[ms]')
+        self.species = metadata['common_name'].astype(object).to_numpy()
+        self.classification_id = metadata['classification_id'].to_numpy()
+        self.boxes = shapely.box(self.lon_min, self.lat_min, self.lon_max, self.lat_max)
+        self.tree = shapely.STRtree(self.boxes)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def query(self, area=None, start=None, end=None, species=None, classification_ids=None,
+              min_height=None, max_height=None):
+        """ Returns the sorted indices of the tracks matching all given filters.
+
+        area is a shapely geometry in lon/lat; a track crosses it if one of its
+        segments intersects it. With a height band only segments with at least
+        one point inside the band count, e.g. max_height=200 for tracks
+        crossing the area below 200 m. start and end select tracks whose time
+        span overlaps the window. species (common names) and
+        classification_ids are single values or sequences.
+        """
+        if area is not None:
+            candidates = np.unique(self.tree.query(area, predicate='intersects'))
+        else:
+            candidates = np.flatnonzero(self.nonempty)
+
+        keep = np.ones(len(candidates), dtype=bool)
+        if start is not None:
+            keep &= self.end[candidates] >= np.datetime64(start, 'ms')
+        if end is not None:
+            keep &= self.start[candidates] <= np.datetime64(end, 'ms')
+        if species is not None:
+            keep &= np.isin(self.species[candidates], np.atleast_1d(species))
+        if classification_ids is not None:
+            keep &= np.isin(self.classification_id[candidates], np.atleast_1d(classification_ids))
+        if min_height is not None:
+            keep &= self.z_max[candidates] >= min_height
+        if max_height is not None:
+            keep &= self.z_min[candidates] <= max_height
+        candidates = candidates[keep]
+
+        if area is None:
+            # without an area the height band is answered by the per track extents
+            return candidates
+        return self._crossing(candidates, area, min_height, max_height)
+
+    def _crossing(self, candidates, area, min_height=None, max_height=None):
+        """ Returns the candidates with a segment in the height band intersecting area.
+
+        Tracks whose box lies inside the area only need a point in the band.
+        For the others, segments with an end inside the area are decided by a
+        point test and only the rest near the area is tested as lines.
+        """
+        if not len(candidates):
+            return candidates
+        tracks = self.tracks
+        shapely.prepare(area)
+        offsets, points = tracks.gather(candidates)
+        owner = np.repeat(np.arange(len(candidates)), np.diff(offsets))
+
+        z = tracks.z[points]
+        in_band = np.ones(len(points), dtype=bool)
+        if min_height is not None:
+            in_band &= z >= min_height
+        if max_height is not None:
+            in_band &= z <= max_height
+
+        hit = np.zeros(len(candidates), dtype=bool)
+        contained = np.isin(candidates, self.tree.query(area, predicate='contains'))
+        hit[np.unique(owner[in_band & contained[owner]])] = True
+
+        # points of the other tracks inside the area, single point tracks are decided here
+        border = ~contained[owner]
+        inside = np.zeros(len(points), dtype=bool)
+        inside[border] = shapely.intersects_xy(area, tracks.lon[points[border]], tracks.lat[points[border]])
+        hit[np.unique(owner[inside & in_band])] = True
+
+        # segments join consecutive points of the same track and count if one end is in the band
+        use = border[:-1] & (owner[:-1] == owner[1:]) & (in_band[:-1] | in_band[1:])
+        use &= ~hit[owner[:-1]]
+        use &= ~(inside[:-1] | inside[1:])
+        seg_from, seg_to = points[:-1][use], points[1:][use]
+        seg_owner = owner[:-1][use]
+
+        # both ends outside: the segment can only cross if its box meets the bounds of the area
+        lon_min, lat_min, lon_max, lat_max = area.bounds
+        lon0, lat0, lon1, lat1 = tracks.lon[seg_from], tracks.lat[seg_from], tracks.lon[seg_to], tracks.lat[seg_to]
+        near = ((np.maximum(lon0, lon1) >= lon_min) & (np.minimum(lon0, lon1) <= lon_max)
+                & (np.maximum(lat0, lat1) >= lat_min) & (np.minimum(lat0, lat1) <= lat_max))
+        if near.any():
+            coords = np.empty((2 * near.sum(), 2))
+            coords[0::2, 0], coords[0::2, 1] = lon0[near], lat0[near]
+            coords[1::2, 0], coords[1::2, 1] = lon1[near], lat1[near]
+            segments = shapely.linestrings(coords, indices=np.repeat(np.arange(near.sum()), 2))
+            hit[seg_owner[near][shapely.intersects(area, segments)]] = True
+        return candidates[hit]
@@ -0,0 +1,107 @@
+"""Level of detail for drawing radar tracks.
+
+Tracks are simplified in 3-D with Douglas-Peucker: lon/lat are projected to
+metres around the scene origin so a tolerance means the same distance
+horizontally and in height. The simplification runs over the flat point
+arrays of all tracks at once, every pass splits all open segments at their
+farthest point.
+
+For the 3D view the points of the finest level are packed as binary buffers
+(Float32 positions relative to the scene origin, Uint32 offsets per track,
+the level of every point) in base64, in chunks of tracks. The viewer draws the
+coarsest level of all chunks first and then refines the lines level by level.
+"""
+import base64
+
+import numpy as np
+
+from birdrisk.geo import local_xyz, segment_distance
+
+# Tolerances (m) of the drawn levels, the coarsest first
+LOD_TOLERANCES = (25.0, 5.0, 2.0)
+# Tracks per chunk, the viewer builds the lines of one chunk at a time
+CHUNK_TRACKS = 250
+
+
+def simplify(xyz, offsets, tolerance):
+    """ Returns a mask of the points kept by 3-D Douglas-Peucker with tolerance, per track.
+
+    xyz holds the points of all tracks in metres, the points of track i are at
+    offsets[i]:offsets[i + 1]. First and last point of every track are kept.
+    """
+    keep = np.zeros(len(xyz), dtype=bool)
+    lengths = np.diff(offsets)
+    keep[offsets[:-1][lengths > 0]] = True
+    keep[offsets[1:][lengths > 0] - 1] = True
+
+    first, last = offsets[:-1][lengths > 2], offsets[1:][lengths > 2] - 1
+    while len(first):
+        # interior points of all open segments, grouped by segment
+        inner = last - first - 1
+        owner = np.repeat(np.arange(len(first)), inner)
+        points = np.repeat(first + 1 - np.cumsum(inner) + inner, inner) + np.arange(inner.sum())
+        distance = segment_distance(xyz[points], xyz[first[owner]], xyz[last[owner]])
+
+        # farthest point per segment: the first of each group sorted by owner and descending distance
+        order = np.lexsort((-distance, owner))
+        group_first = np.concatenate([[0], np.cumsum(inner)[:-1]])
+        farthest = order[group_first]
+        split = distance[farthest] > tolerance
+        pivot = points[farthest[split]]
+        keep[pivot] = True
+
+        first, last = np.concatenate([first[split], pivot]), np.concatenate([pivot, last[split]])
+        open_ = last - first > 1
+        first, last = first[open_], last[open_]
+    return keep
+
+
+def _b64(values):
+    return base64.b64encode(np.ascontiguousarray(values).tobytes()).decode('ascii')
+
+
+def point_levels(xyz, offsets, tolerances=LOD_TOLERANCES):
+    """ Returns the coarsest level (index into tolerances sorted coarse to fine) keeping every point, -1 if none.
+
+    Douglas-Peucker with a smaller tolerance splits at the same points first,
+    so the points of a level include those of all coarser levels.
+    """
+    levels = np.full(len(xyz), -1, dtype=np.int8)
+    for level, tolerance in reversed(list(enumerate(sorted(tolerances, reverse=True)))):
+        levels[simplify(xyz, offsets, tolerance)] = level
+    return levels
+
+
+def lod_buffers(tracks, indices, tolerances=LOD_TOLERANCES, chunk_tracks=CHUNK_TRACKS):
+    """ Returns some tracks of a TrackSet simplified for the 3D view.
+
+    Only the points of the finest level are sent, each with the coarsest
+    level it belongs to, so a level is drawn by the points with a level up to
+    it. The result has the scene origin (lon, lat), the tolerances (coarse
+    first) and chunks of chunk_tracks tracks, each with the index of its
+    'first' track and base64 buffers: 'offsets' (Uint32, per track into the
+    points of the chunk), 'positions' (Float32 lon and lat relative to the
+    origin and height per point) and 'levels' (Uint8 per point).
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    tolerances = sorted(tolerances, reverse=True)
+    offsets, points = tracks.gather(indices)
+    lon, lat, z = tracks.lon[points], tracks.lat[points], tracks.z[points]
+    origin = (float(np.mean(lon)), float(np.mean(lat))) if len(points) else (0.0, 0.0)
+    levels = point_levels(local_xyz(lon, lat, z, origin), offsets, tolerances)
+    # relative degrees keep Float32 precise to a few millimetres
+    positions = np.column_stack([lon - origin[0], lat - origin[1], z]).astype(np.float32)
+
+    keep = levels >= 0
+    kept = np.concatenate([[0], np.cumsum(keep)])[offsets]
+    positions, levels = positions[keep], levels[keep].astype(np.uint8)
+    chunks = []
+    for first in range(0, len(indices), chunk_tracks):
+        chunk = kept[first:min(first + chunk_tracks, len(indices)) + 1]
+        chunks.append({
+            'first': first,
+            'offsets': _b64((chunk - chunk[0]).astype(np.uint32)),
+            'positions': _b64(positions[chunk[0]:chunk[-1]]),
+            'levels': _b64(levels[chunk[0]:chunk[-1]]),
+        })
+    return {'origin': origin, 'tolerances': tolerances, 'chunks': chunks}
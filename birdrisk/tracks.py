@@ -0,0 +1,219 @@
+"""Bird radar tracks in a compact ragged-array layout.
+
+The track exports store every track as a WKT LINESTRING ZM (lon lat z m per
+point) and its point times as a Postgres array string ({0,0.99,...}, seconds
+since the start of the track). Both are parsed with Arrow compute kernels into
+list columns: one flat array of values per coordinate plus one offsets array,
+so the points of track i are values[offsets[i]:offsets[i + 1]].
+
+The parsed tracks are written as an uncompressed Arrow IPC file that is
+memory mapped on load, so the arrays are used in place without copying.
+
+Convert an export, e.g.
+
+    python -m birdrisk.tracks data/test_radar_data_for_reto.csv
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+from birdrisk import CACHE_DIR
+
+TRACKS_DIR = os.path.join(CACHE_DIR, 'tracks')
+
+# Per track columns of the export and their types
+TRACK_SCHEMA = {
+    'id': pa.int64(),
+    'count': pa.int32(),
+    'nr_of_plots': pa.int32(),
+    'assignable_properties': pa.string(),
+    'classification_id': pa.int16(),
+    'species_id': pa.int16(),
+    'common_name': pa.dictionary(pa.int32(), pa.string()),
+    'mean_rcs': pa.float32(),
+    'median_rcs': pa.float32(),
+    'tracklength_m': pa.float32(),
+    'airspeed': pa.float32(),
+    'min_height': pa.float32(),
+    'max_height': pa.float32(),
+    'timestamp_start': pa.timestamp('ms'),
+    'timestamp_end': pa.timestamp('ms'),
+    'duration_s': pa.float32(),
+    'doy': pa.int16(),
+    'month': pa.int8(),
+    'hour': pa.int8(),
+    'trajectory_time': pa.string(),
+    'latlon': pa.string(),
+}
+# Schema metadata of a converted export: its absolute path and its size and mtime when converted
+SOURCE_KEY = b'birdrisk.source'
+SIGNATURE_KEY = b'birdrisk.source_signature'
+# Point columns: WGS84 degrees, height in m, the M value (RCS in dBsm) and seconds since the track start
+POINT_TYPES = {'lon': pa.float64(), 'lat': pa.float64(), 'z': pa.float32(), 'm': pa.float32(), 't': pa.float32()}
+
+
+def _pg_array(strings):
+    """ Splits Postgres array strings ({a,b,c}) into a list array of strings. """
+    inner = pc.replace_substring_regex(strings, pattern=r'^\{|\}$', replacement='')
+    return pc.split_pattern(inner, pattern=',')
+
+
+def _list_like(lists, values, value_type):
+    """ Returns values cast to value_type as a list array with the offsets of lists. """
+    return pa.ListArray.from_arrays(lists.offsets, values.cast(value_type))
+
+
+def parse_tracks(source):
+    """ Parses a track export (CSV file or stream) into a table with one row per track.
+
+    The point columns lon, lat, z, m and t are list columns, all other columns
+    keep the per track fields of the export with compact types.
+    """
+    table = pacsv.read_csv(source, convert_options=pacsv.ConvertOptions(column_types=TRACK_SCHEMA))
+    table = table.combine_chunks()
+
+    # "LINESTRING ZM (x y z m,x y z m,...)" -> points -> 4 values per point
+    wkt = pc.replace_substring_regex(table['latlon'].chunk(0), pattern=r'^[^(]*\(|\)$', replacement='')
+    points = pc.split_pattern(pc.utf8_trim_whitespace(wkt), pattern=',')
+    values = pc.split_pattern(pc.utf8_trim_whitespace(points.flatten()), pattern=' ')
+    if not pc.all(pc.equal(pc.list_value_length(values), 4)).as_py():
+        raise ValueError("Every track point needs 4 coordinates (LINESTRING ZM)")
+    coordinates = values.flatten().cast(pa.float64()).to_numpy().reshape(-1, 4)
+
+    times = _pg_array(table['trajectory_time'].chunk(0))
+    if times.offsets != points.offsets:
+        raise ValueError("trajectory_time and latlon have a different number of points")
+
+    columns = {name: table[name] for name in table.column_names if name not in ('latlon', 'trajectory_time')}
+    columns['assignable_properties'] = _pg_array(table['assignable_properties'].chunk(0))
+    for i, name in enumerate(('lon', 'lat', 'z', 'm')):
+        columns[name] = _list_like(points, pa.array(coordinates[:, i]), POINT_TYPES[name])
+    columns['t'] = _list_like(times, times.flatten(), POINT_TYPES['t'])
+    return pa.table(columns)
+
+
+def source_signature(source):
+    """ Returns the size and modification time of a file, they change whenever the file is rewritten. """
+    stat = os.stat(source)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def write_tracks(table, path, source=None):
+    """ Writes parsed tracks to an uncompressed Arrow IPC file, so loading can map it without copying.
+
+    With source the path and signature of the export are kept in the schema
+    metadata, so get_tracks can tell whether the file is current.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if source is not None:
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            SOURCE_KEY: os.path.abspath(source).encode(),
+            SIGNATURE_KEY: source_signature(source).encode(),
+        })
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table.combine_chunks())
+    os.replace(tmp_path, path)
+
+
+class TrackSet:
+    """Tracks with their points in flat arrays.
+
+    lon, lat, z, m and t hold the points of all tracks one after the other, the
+    points of track i are at offsets[i]:offsets[i + 1]. The arrays are views
+    into the Arrow buffers, of a memory mapped file if loaded with load_tracks,
+    whose path is kept so other processes can map the same file.
+    """
+
+    def __init__(self, table, path=None):
+        self.table = table.combine_chunks()
+        self.path = path
+        self.offsets = self._column('t').offsets.to_numpy()
+        for name in POINT_TYPES:
+            setattr(self, name, self._column(name).values.to_numpy())
+
+    def _column(self, name):
+        column = self.table[name]
+        return column.chunk(0) if column.num_chunks else pa.array([], type=column.type)
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def lengths(self):
+        """ Number of points of every track. """
+        return np.diff(self.offsets)
+
+    @property
+    def track_index(self):
+        """ Index of the track of every point. """
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def gather(self, indices):
+        """ Returns the offsets of a subset of tracks and the indices of their points in the flat arrays. """
+        lengths = self.lengths[indices]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        points = np.repeat(self.offsets[indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return offsets, points
+
+    def metadata(self):
+        """ Returns the per track fields as a DataFrame. """
+        return self.table.drop_columns(list(POINT_TYPES)).to_pandas()
+
+    def points(self, i):
+        """ Returns the points of track i as a dict of arrays. """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {name: getattr(self, name)[start:end] for name in POINT_TYPES}
+
+
+def load_tracks(path):
+    """ Loads tracks written by write_tracks, the file is memory mapped and not read into memory. """
+    return TrackSet(pa.ipc.open_file(pa.memory_map(path, 'r')).read_all(), path)
+
+
+def tracks_path(csv_path, root=TRACKS_DIR):
+    """ Returns the Arrow file of an export, keyed by its absolute path as exports of different radars share names. """
+    key = hashlib.sha1(os.path.abspath(csv_path).encode()).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(root, f'{name}-{key}.arrow')
+
+
+def is_current(path, csv_path):
+    """ Returns whether the Arrow file at path was converted from the current version of the export. """
+    try:
+        metadata = pa.ipc.open_file(pa.memory_map(path, 'r')).schema.metadata or {}
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return False
+    return (metadata.get(SOURCE_KEY) == os.path.abspath(csv_path).encode()
+            and metadata.get(SIGNATURE_KEY) == source_signature(csv_path).encode())
+
+
+def get_tracks(csv_path, root=TRACKS_DIR):
+    """ Returns the tracks of an export, converting it first if it has no up to date Arrow file. """
+    path = tracks_path(csv_path, root)
+    if not is_current(path, csv_path):
+        write_tracks(parse_tracks(csv_path), path, source=csv_path)
+    return load_tracks(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a bird radar track export to the Arrow track format.")
+    parser.add_argument('csv', help="track export with the latlon and trajectory_time columns")
+    parser.add_argument('output', nargs='?', default=None, help="Arrow file (default: in the local track store)")
+    args = parser.parse_args()
+
+    output = args.output or tracks_path(args.csv)
+    table = parse_tracks(args.csv)
+    write_tracks(table, output, source=args.csv)
+    tracks = load_tracks(output)
+    print(f"{len(tracks)} tracks, {len(tracks.t)} points -> {output} ({os.path.getsize(output) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Access to the vertical profile time series (VPTS) published in the aloftdata bucket.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import requests
+
+from birdrisk.sessions import get_session
+
+BASE_URL = 'https://aloftdata.s3-eu-west-1.amazonaws.com/baltrad/daily/'
+MONTHLY_URL = 'https://aloftdata.s3-eu-west-1.amazonaws.com/baltrad/monthly/'
+
+# (connect, read) timeout in seconds, applied to every single file
+TIMEOUT = (5, 30)
+MAX_WORKERS = 8
+
+# Columns the app reads from a VPTS file and their in-memory types. Heights are
+# the lower bin edges in m, densities in birds/km3, speeds in m/s, directions in degrees.
+VPTS_SCHEMA = {
+    'radar': pa.dictionary(pa.int32(), pa.string()),
+    'datetime': pa.timestamp('s', tz='UTC'),
+    'height': pa.int16(),
+    'ff': pa.float32(),
+    'dd': pa.float32(),
+    'dens': pa.float32(),
+}
+DEFAULT_COLUMNS = ('datetime', 'height', 'dens')
+
+# Pool name of the aloftdata downloads in birdrisk.sessions
+SESSION_NAME = 'aloftdata'
+
+
+def vpts_url(radar, date, base_url=BASE_URL):
+    """ Returns the URL of the daily VPTS file of a radar. """
+    return f'{base_url}{radar}/{date.year}/{radar}_vpts_{date:%Y%m%d}.csv'
+
+
+def baseline_dates(date, n_years):
+    """ Returns the same calendar day in each of the n_years preceding years. """
+    dates = []
+    for i in range(1, n_years + 1):
+        try:
+            dates.append(date.replace(year=date.year - i))
+        except ValueError:
+            # 29 February does not exist in the baseline year
+            dates.append(date.replace(year=date.year - i, day=28))
+    return dates
+
+
+def read_vpts(source, columns=DEFAULT_COLUMNS, compression=None):
+    """ Parses a VPTS CSV file or byte stream, keeping only the requested columns.
+
+    All VPTS files, downloaded or local, should be read through this function so
+    every caller gets the same compact dtypes (see VPTS_SCHEMA).
+    """
+    columns = list(columns)
+    unknown = set(columns) - set(VPTS_SCHEMA)
+    if unknown:
+        raise ValueError(f"Unsupported VPTS columns: {', '.join(sorted(unknown))}")
+
+    if compression:
+        source = pa.input_stream(source, compression=compression)
+    table = pacsv.read_csv(source, convert_options=pacsv.ConvertOptions(
+        include_columns=columns,
+        column_types={column: VPTS_SCHEMA[column] for column in columns},
+    ))
+    return table.to_pandas()
+
+
+def load_data(url, session=None, timeout=TIMEOUT, columns=DEFAULT_COLUMNS):
+    """ Downloads a single VPTS file and parses it while it streams in. """
+    session = session or get_session(SESSION_NAME)
+    with session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return read_vpts(response.raw, columns)
+
+
+def fetch_day(radar, date, base_url=BASE_URL, session=None, timeout=TIMEOUT, cache=None, columns=DEFAULT_COLUMNS):
+    """ Returns the VPTS of one radar and day, served from the cache where possible.
+
+    The cache always stores every column of VPTS_SCHEMA, so later requests for
+    other columns can be answered from the same copy.
+    """
+    columns = list(columns)
+    if cache is None:
+        return load_data(vpts_url(radar, date, base_url), session, timeout, columns)
+    if cache.is_fresh(radar, date):
+        return cache.load(radar, date, columns)
+
+    session = session or get_session(SESSION_NAME)
+    stored = cache.exists(radar, date)
+    etag = cache.etag(radar, date) if stored else None
+    try:
+        with session.get(vpts_url(radar, date, base_url), timeout=timeout, stream=True,
+                         headers={'If-None-Match': etag} if etag else None) as response:
+            if response.status_code == 304:
+                cache.touch(radar, date)
+                return cache.load(radar, date, columns)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            frame = read_vpts(response.raw, VPTS_SCHEMA)
+    except requests.RequestException:
+        # an outdated copy is better than nothing
+        if stored:
+            return cache.load(radar, date, columns)
+        raise
+
+    cache.save(radar, date, frame, response.headers.get('ETag'))
+    return frame[columns]
+
+
+def fetch_vpts(radar, dates, base_url=BASE_URL, timeout=TIMEOUT, max_workers=MAX_WORKERS, session=None, cache=None,
+               columns=DEFAULT_COLUMNS):
+    """ Downloads the daily VPTS files of one radar for several dates concurrently.
+
+    Returns two dicts keyed by date: the loaded frames and the errors of the
+    files that could not be fetched, so one missing day does not fail the rest.
+    Pass a VptsCache to serve repeated requests from disk.
+    """
+    session = session or get_session(SESSION_NAME, max_workers)
+    dates = list(dates)
+    frames, errors = {}, {}
+    if not dates:
+        return frames, errors
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(dates))) as pool:
+        futures = {date: pool.submit(fetch_day, radar, date, base_url, session, timeout, cache, columns)
+                   for date in dates}
+        for date, future in futures.items():
+            try:
+                frames[date] = future.result()
+            except Exception as e:
+                errors[date] = e
+    return frames, errors
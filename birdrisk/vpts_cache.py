@@ -0,0 +1,73 @@
+"""Persistent local store of daily VPTS files.
+"""
+import os
+import time
+from datetime import date as date_cls, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from birdrisk import CACHE_DIR
+from birdrisk.lru import LruStore
+from birdrisk.vpts import VPTS_SCHEMA
+
+ETAG_KEY = b'birdrisk.etag'
+
+
+class VptsCache(LruStore):
+    """Parquet copies of the daily VPTS files, keyed by radar and date.
+
+    Days older than immutable_after_days no longer change upstream and are
+    served without any network access. More recent days are revalidated once
+    their copy is older than ttl. The store is kept below max_bytes by evicting
+    the least recently used days. The modification time of a file records
+    when it was last validated, its access time when it was last read.
+    """
+
+    def __init__(self, root=None, max_bytes=2 * 1024 ** 3, immutable_after_days=3, ttl=timedelta(hours=1)):
+        super().__init__(root or os.path.join(CACHE_DIR, 'vpts'), max_bytes)
+        self.immutable_after_days = immutable_after_days
+        self.ttl = ttl
+
+    def path(self, radar, date):
+        return os.path.join(self.root, radar, str(date.year), f'{radar}_vpts_{date:%Y%m%d}.parquet')
+
+    def exists(self, radar, date):
+        return os.path.exists(self.path(radar, date))
+
+    def is_immutable(self, date):
+        return (date_cls.today() - date).days > self.immutable_after_days
+
+    def is_fresh(self, radar, date):
+        """ Returns True if the stored copy can be used without asking the server. """
+        try:
+            validated = os.stat(self.path(radar, date)).st_mtime
+        except FileNotFoundError:
+            return False
+        return self.is_immutable(date) or time.time() - validated < self.ttl.total_seconds()
+
+    def etag(self, radar, date):
+        """ Returns the ETag the stored copy was downloaded with, if any. """
+        metadata = pq.read_schema(self.path(radar, date)).metadata or {}
+        etag = metadata.get(ETAG_KEY)
+        return etag.decode() if etag else None
+
+    def load(self, radar, date, columns=None):
+        path = self.path(radar, date)
+        table = pq.read_table(path, columns=columns)
+        # Parquet has no second resolution timestamps, cast back so cached and fresh days get the same dtypes
+        schema = pa.schema([pa.field(field.name, VPTS_SCHEMA.get(field.name, field.type)) for field in table.schema])
+        frame = table.cast(schema).to_pandas()
+        # keep the validation time, only mark the file as recently used
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+        return frame
+
+    def save(self, radar, date, frame, etag=None):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if etag:
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), ETAG_KEY: etag.encode()})
+        self._write(self.path(radar, date), table)
+
+    def touch(self, radar, date):
+        """ Marks the stored copy as validated now, e.g. after a 304 response. """
+        os.utime(self.path(radar, date))
@@ -0,0 +1,136 @@
+"""Bulk ingestion of the monthly VPTS archives into the local VPTS store.
+
+One monthly archive replaces about 30 daily downloads. Every day of the archive
+is stored as its own partition in the VptsCache, so the daily lookups of the
+pages are answered from disk afterwards.
+
+Backfill a season for all radars of the radar_sites table:
+
+    python -m birdrisk.vpts_monthly 2023-08 2023-11
+
+A local folder with the bucket layout can stand in for S3 with --base-url.
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
+from birdrisk.radar_sites import bigquery_client, load_registry
+from birdrisk.sessions import get_session
+from birdrisk.vpts import MAX_WORKERS, MONTHLY_URL, SESSION_NAME, TIMEOUT, VPTS_SCHEMA, read_vpts
+from birdrisk.vpts_cache import VptsCache
+
+
+def monthly_url(radar, year, month, base_url=MONTHLY_URL):
+    """ Returns the URL (or local path) of the monthly VPTS archive of a radar. """
+    name = f'{radar}_vpts_{year}{month:02d}.csv.gz'
+    if base_url.startswith(('http://', 'https://')):
+        return f'{base_url}{radar}/{year}/{name}'
+    return os.path.join(base_url.removeprefix('file://'), radar, str(year), name)
+
+
+def month_range(start, end):
+    """ Returns all (year, month) tuples from start to end, both given as 'YYYY-MM'. """
+    year, month = map(int, start.split('-'))
+    end_year, end_month = map(int, end.split('-'))
+    months = []
+    while (year, month) <= (end_year, end_month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def month_days(year, month):
+    first = date(year, month, 1)
+    next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return [date.fromordinal(day) for day in range(first.toordinal(), next_month.toordinal())]
+
+
+def load_month(radar, year, month, base_url=MONTHLY_URL, session=None, timeout=TIMEOUT):
+    """ Reads a monthly archive with all columns of VPTS_SCHEMA. """
+    url = monthly_url(radar, year, month, base_url)
+    if not url.startswith(('http://', 'https://')):
+        with open(url, 'rb') as f:
+            return read_vpts(f, VPTS_SCHEMA, compression='gzip')
+
+    session = session or get_session(SESSION_NAME)
+    with session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        # the archive is a gzip file, not a gzip transfer encoding
+        response.raw.decode_content = False
+        return read_vpts(response.raw, VPTS_SCHEMA, compression='gzip')
+
+
+def ingest_month(radar, year, month, cache, base_url=MONTHLY_URL, session=None, timeout=TIMEOUT, force=False):
+    """ Stores every day of a monthly archive in the cache and returns the stored dates.
+
+    Months of which every day is already stored are skipped unless force is set.
+    """
+    if not force and all(cache.exists(radar, day) for day in month_days(year, month)):
+        return []
+
+    frame = load_month(radar, year, month, base_url, session, timeout)
+    days = frame['datetime'].dt.floor('D')
+    stored = []
+    for day, part in frame.groupby(days, sort=True):
+        cache.save(radar, day.date(), part.reset_index(drop=True))
+        stored.append(day.date())
+    return stored
+
+
+def backfill(radars, months, cache, base_url=MONTHLY_URL, max_workers=MAX_WORKERS, progress=None):
+    """ Ingests the monthly archives of several radars concurrently.
+
+    Returns the errors keyed by (radar, year, month); progress is called with
+    the number of finished archives and the total.
+    """
+    session = get_session(SESSION_NAME, max_workers)
+    tasks = [(radar, year, month) for radar in radars for year, month in months]
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(ingest_month, radar, year, month, cache, base_url, session): (radar, year, month)
+                   for radar, year, month in tasks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+            if progress:
+                progress(done, len(tasks))
+    return errors
+
+
+def radar_site_ids():
+    """ Returns the ids of all radars of the radar_sites table, using the Streamlit secrets for BigQuery. """
+    import streamlit as st
+
+    registry = load_registry(lambda: bigquery_client(st.secrets["gcp_service_account"]))
+    return registry.sites['radar'].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the local VPTS store from monthly archives.")
+    parser.add_argument('start', help="first month, YYYY-MM")
+    parser.add_argument('end', help="last month, YYYY-MM")
+    parser.add_argument('--radar', action='append', dest='radars',
+                        help="radar id, can be repeated (default: all radars of the radar_sites table)")
+    parser.add_argument('--base-url', default=MONTHLY_URL, help="monthly archive root, URL or local folder")
+    parser.add_argument('--cache-dir', default=None, help="root of the local VPTS store")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    radars = args.radars or radar_site_ids()
+    cache = VptsCache(root=args.cache_dir)
+    months = month_range(args.start, args.end)
+
+    def progress(done, total):
+        print(f"\r{done}/{total} archives", end='', flush=True)
+
+    errors = backfill(radars, months, cache, args.base_url, args.workers, progress)
+    print()
+    for (radar, year, month), error in sorted(errors.items()):
+        print(f"{radar} {year}-{month:02d}: {error}")
+
+
+if __name__ == "__main__":
+    main()
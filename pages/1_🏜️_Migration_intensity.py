@@ -1,17 +1,20 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objs as go
-import requests
-from io import StringIO
 from datetime import datetime, timedelta
-from google.oauth2 import service_account
-from google.cloud import bigquery
-from astral.sun import sun
-from astral import Observer
 import numpy as np
-import geopy
-from geopy.distance import geodesic
+from birdrisk.climatology import ClimatologyStore
+from birdrisk.exposure import swept_bands, swept_exposure, turbine_table
+from birdrisk.geo import range_rings
+from birdrisk.grid import density_grid, downsample_grid, grid_max
+from birdrisk.mtr import MTR_COLUMNS, nightly_passage
+from birdrisk.query import DuckDBBackend
+from birdrisk.maplayers import arrow_layer, map_figure, ring_layer, station_layer
+from birdrisk.radar_sites import get_radar_registry
+from birdrisk.season import aggregate_season
+from birdrisk.solar import PERIODS, solar_table, split_exposure
+from birdrisk.vpts import baseline_dates, fetch_vpts, vpts_url
+from birdrisk.vpts_cache import VptsCache
 
 # Set up Streamlit page
 st.set_page_config(layout="wide")
@@ -48,25 +51,23 @@ Visualizing vertical profiles from ENRAM radar. Test the connection to AWS.
 # Date selection
     # Date selector
 d = datetime.today() - timedelta(days=3)
-crit_height = 200
+crit_height = 200  # default height of the rotor swept area above the radar
 
 
-selected_date = st.date_input("Select a date (72h from current date)", d)
+view_mode = st.radio("View", ["Single day", "Date range"], horizontal=True)
+if view_mode == "Single day":
+    selected_date = st.date_input("Select a date (72h from current date)", d)
+    n_years = st.slider("Number of years for the baseline", min_value=1, max_value=10, value=3)
+else:
+    range_dates = st.date_input("Select a date range", (d - timedelta(days=30), d))
 
+# Turbine design defining the rotor swept area
+with st.sidebar.expander("Turbine configuration"):
+    hub_height = st.number_input("Hub height (m)", min_value=10, max_value=300, value=crit_height // 2)
+    rotor_diameter = st.number_input("Rotor diameter (m)", min_value=10, max_value=300, value=crit_height)
 
-# Create API client.
-credentials = service_account.Credentials.from_service_account_info(
-    st.secrets["gcp_service_account"]
-)
-client = bigquery.Client(credentials=credentials)
-
-# Perform query.
-# Uses st.cache_data to only rerun when the query changes or after 10 min.
 
-
-# Fetch radar station data from BigQuery
-sql = """SELECT radar, latitude, longitude, elevation FROM `visavis-312202.wp4_dev.radar_sites` LIMIT 20"""
-df = client.query(sql).to_dataframe()
+df = get_radar_registry().sites[['radar', 'latitude', 'longitude', 'elevation']].head(20).copy()
 
 df['wind_speed'] = np.random.uniform(5, 25, size=len(df))  # Wind speed in m/s
 df['wind_dir'] = np.random.uniform(0, 360, size=len(df))    # Wind direction in degrees
@@ -79,80 +80,27 @@ df['bird_u'] = 10 * np.cos(np.radians(df['bird_dir']))  # Fixed scaling for bird
 df['bird_v'] = 10 * np.sin(np.radians(df['bird_dir']))  # Fixed scaling for bird direction
 
 # Add a map to the app to display radar locations
-# Function to calculate points of a circle given center and radius
-def calculate_circle_points(lat, lon, radius_km, num_points=100):
-    """ Returns the latitude and longitude points of a circle around a central point. """
-    angles = np.linspace(0, 360, num_points)
-    circle_points = []
-    
-    for angle in angles:
-        # Calculate destination points from center at each angle
-        destination = geodesic(kilometers=radius_km).destination((lat, lon), angle)
-        circle_points.append((destination.latitude, destination.longitude))
-    
-    return pd.DataFrame(circle_points, columns=['latitude', 'longitude'])
+# 50 km circles around all radars, computed in one batch and cached across reruns
+circles = range_rings(df['latitude'], df['longitude'], radii_km=50)[:, 0]
 
 # Generate a random "density" value for each radar to use for the color ramp (can be replaced by real data)
 df['density_value'] = np.random.uniform(0, 1, size=len(df))  # Values between 0 (green) and 1 (red)
 
 
-# Create a map plot using Plotly
-fig = px.scatter_mapbox(df,
-                        lat='latitude',
-                        lon='longitude',
-                        hover_name='radar',
-                        hover_data={'latitude': False, 'longitude': False, 'wind_speed': True, 'wind_dir': True, 'bird_dir': True},
-                        zoom=3,
-                        height=500)
-
-# Add wind direction and bird direction as arrows on the map
-for i, row in df.iterrows():
-
-    
-    # Add 50 km radius circle around each radar
-    circle_points = calculate_circle_points(row['latitude'], row['longitude'], radius_km=50)
-    # Use the density value to determine the color of the circle (green to red)
-    color_scale = px.colors.sequential.Greens  # Greenish color scale
-    color_index = int(row['density_value'] * (len(color_scale) - 1))  # Map density value to color scale index
-    circle_color = color_scale[color_index]
-    fig.add_trace(go.Scattermapbox(
-        mode='lines',
-        lon=circle_points['longitude'],
-        lat=circle_points['latitude'],
-        fill='toself',
-        fillcolor=circle_color,
-        line=dict(width=2, color=circle_color),
-        showlegend=False
-    ))
-    # Wind direction arrow (scaled with wind speed)
-    fig.add_trace(go.Scattermapbox(
-        mode="markers+lines",
-        lon=[row['longitude'], row['longitude'] + 0.1 * row['wind_u']],  # Scale the arrow by a factor for visibility
-        lat=[row['latitude'], row['latitude'] + 0.1 * row['wind_v']],
-        marker={'size': 10, 'symbol': "arrow-bar", 'angle': row['wind_dir']},
-        line=dict(width=2, color='blue'),
-        showlegend=False,  # Remove from legend
-        name=f"Wind: {row['wind_speed']:.1f} m/s, {row['wind_dir']:.1f}°"
-    ))
-
-    # Bird mean direction arrow (fixed scaling)
-    fig.add_trace(go.Scattermapbox(
-        mode="markers+lines",
-        lon=[row['longitude'], row['longitude'] + 0.05 * row['bird_u']],  # Scale the arrow by a smaller factor
-        lat=[row['latitude'], row['latitude'] + 0.05 * row['bird_v']],
-        marker={'size': 10, 'symbol': "arrow-bar", 'angle': row['bird_dir']},
-        line=dict(width=2, color='red'),
-        name=f"Bird: {row['bird_dir']:.1f}°",
-        showlegend=False  # Remove from legend
-
-    ))
-
-
-# Plot the density grid for all radars as a scatter plot with color scale
-
-# Configure map layout
-fig.update_layout(mapbox_style="open-street-map")
-fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+# Create a map plot using Plotly, one trace per layer regardless of the number of radars
+station_text = [f"<b>{row.radar}</b><br>wind_speed={row.wind_speed:.1f}<br>wind_dir={row.wind_dir:.1f}<br>bird_dir={row.bird_dir:.1f}"
+                for row in df.itertuples()]
+fig = map_figure([
+    # 50 km radius circle around each radar, coloured by the density value (green scale)
+    ring_layer(circles, df['density_value'], hover_text=df['radar']),
+    # Wind direction arrows (scaled with wind speed)
+    arrow_layer(df['latitude'], df['longitude'], 0.1 * df['wind_v'], 0.1 * df['wind_u'], df['wind_dir'], 'blue',
+                hover_text=[f"Wind: {speed:.1f} m/s, {direction:.1f}°" for speed, direction in zip(df['wind_speed'], df['wind_dir'])]),
+    # Bird mean direction arrows (fixed scaling)
+    arrow_layer(df['latitude'], df['longitude'], 0.05 * df['bird_v'], 0.05 * df['bird_u'], df['bird_dir'], 'red',
+                hover_text=[f"Bird: {direction:.1f}°" for direction in df['bird_dir']]),
+    station_layer(df['latitude'], df['longitude'], df['radar'], hover_text=station_text),
+], df['latitude'], df['longitude'], zoom=3, height=500)
 
 # Display the map in Streamlit
 selected_radar = st.plotly_chart(fig, use_container_width=True)
@@ -160,70 +108,137 @@ selected_radar = st.plotly_chart(fig, use_container_width=True)
 ## station selection
 radar_stat = st.selectbox("Select a radar station",df.radar)
 filtered_df = df[df['radar'] == radar_stat]
-observer = Observer(latitude=filtered_df.latitude, longitude=filtered_df.longitude, elevation=filtered_df.elevation)
 
 
-# Function to load data from a URL and return a DataFrame
-def load_data(url):
-    response = requests.get(url)
-    data = StringIO(response.text)
-    df = pd.read_csv(data)
-    return df
+@st.cache_resource
+def get_vpts_cache():
+    return VptsCache()
 
-#rad_stationID = 'nohur'
-# Base URL of the dataset
-#base_url = 'https://aloftdata.s3-eu-west-1.amazonaws.com/baltrad/daily/bejab/2018/bejab_vpts_'
-base_url = 'https://aloftdata.s3-eu-west-1.amazonaws.com/baltrad/daily/'
 
-monthly_url = 'https://aloftdata.s3-eu-west-1.amazonaws.com/baltrad/monthly/'
+# Aggregates over the cached days are pushed down to DuckDB on the cache files
+@st.cache_resource
+def get_query_backend():
+    return DuckDBBackend(vpts_root=get_vpts_cache().root)
 
 
+# 5 minute bins, the resolution of the VPTS files, so the baseline has the times of the selected day
+@st.cache_resource
+def get_climatology_store():
+    return ClimatologyStore(time_bin_minutes=5)
 
 
-year_sel = selected_date.year
-selected_date_str = selected_date.strftime('%Y%m%d')
-
+# Sun events of all radars for a whole year, computed in one pass and shared by all sessions
+@st.cache_resource
+def get_solar_table(year):
+    sites = get_radar_registry().sites
+    return solar_table(sites['radar'], sites['latitude'], sites['longitude'], year)
 
-y1 = selected_date.replace(year=selected_date.year - 1)
-y1 = y1.strftime('%Y%m%d')
 
-y2 = selected_date.replace(year=selected_date.year - 2)
-y2 = y2.strftime('%Y%m%d')
+rad_el = filtered_df['elevation'].iloc[0] 
+rad_el = int(rad_el)
+# turbine standing at the radar elevation
+turbines = turbine_table(hub_height, rotor_diameter, ground_elevation=rad_el)
+
+## date range: days are streamed through the aggregation one chunk at a time
+if view_mode == "Date range":
+    if len(range_dates) != 2:
+        st.info("Select the first and the last day of the range.")
+        st.stop()
+    range_start, range_end = range_dates
+    progress_bar = st.progress(0.0, text="Loading days...")
+
+    def show_progress(done, total):
+        progress_bar.progress(done / total, text=f"Loaded {done} of {total} days")
+
+    season = aggregate_season(radar_stat, range_start, range_end, turbines=turbines,
+                              progress=show_progress, cache=get_vpts_cache(), columns=MTR_COLUMNS)
+    progress_bar.empty()
+    if not season.days:
+        st.error("No data available for the selected range.")
+        st.stop()
+    if season.missing:
+        st.warning(f"{len(season.missing)} days without data in the selected range.")
+
+    st.subheader(f' {radar_stat} / {range_start} - {range_end}')
+    # birds crossing 1 km of front per night, from density, ground speed and bin thickness
+    nightly = season.passage_totals()
+    peaks = nightly.nlargest(5, 'passage')
+    fig_nights = go.Figure(go.Bar(
+        x=nightly['night'],
+        y=nightly['passage'],
+        marker_color=np.where(nightly['night'].isin(peaks['night']), 'red', 'blue'),
+    ))
+    fig_nights.update_layout(
+        title='Migration traffic per night (peak nights in red)',
+        xaxis_title='Night',
+        yaxis_title='Birds/km',
+        template='plotly_white',
+        height=500
+    )
+    st.plotly_chart(fig_nights, use_container_width=True)
+
+    # mean density per time block, at most MAX_COLUMNS blocks over the whole range
+    range_times, range_heights, range_values = season.range_grid()
+    fig_range = go.Figure(data=go.Heatmap(z=range_values.T, x=range_times, y=range_heights, colorscale='Viridis'))
+    fig_range.update_layout(title='Density per height', xaxis_title='Datetime', yaxis_title='Height',
+                            template='plotly_white', height=500)
+    st.plotly_chart(fig_range, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        profile = season.height_profile()
+        fig_profile = go.Figure(go.Scatter(x=profile['dens'], y=profile['height'], mode='lines+markers'))
+        fig_profile.update_layout(title='Mean density per height', xaxis_title='Density', yaxis_title='Height',
+                                  template='plotly_white', height=500)
+        st.plotly_chart(fig_profile, use_container_width=True)
+    with col2:
+        st.dataframe(peaks.rename(columns={'night': 'Peak night', 'passage': 'Birds/km',
+                                           'swept_passage': 'Birds/km in rotor swept area'}), hide_index=True)
+        # the loaded days are in the cache, the share is summed there per day
+        lower, upper = swept_bands(turbines)
+        swept = get_query_backend().swept_fraction(radar_stat, range_start, range_end, lower[0], upper[0])
+        share = swept['swept'].sum() / swept['total'].sum() if swept['total'].sum() > 0 else np.nan
+        st.metric("Share of birds within the rotor swept area", f"{share * 100:.1f} %")
+
+    fig_swept = go.Figure(go.Bar(x=swept['date'], y=swept['fraction'] * 100))
+    fig_swept.update_layout(title='Share of birds within the rotor swept area per day', xaxis_title='Date',
+                            yaxis_title='%', template='plotly_white', height=400)
+    st.plotly_chart(fig_swept, use_container_width=True)
+    st.stop()
 
-y3 = selected_date.replace(year=selected_date.year - 3)
-y3 = y3.strftime('%Y%m%d')
 
-data_url = f'{base_url}{radar_stat}/{year_sel}/{radar_stat}_vpts_{selected_date_str}.csv'
-url1 = f'{base_url}{radar_stat}/{year_sel-1}/{radar_stat}_vpts_{y1}.csv'
-url2 = f'{base_url}{radar_stat}/{year_sel-2}/{radar_stat}_vpts_{y2}.csv'
-url3 = f'{base_url}{radar_stat}/{year_sel-3}/{radar_stat}_vpts_{y3}.csv'
+year_sel = selected_date.year
+past_dates = baseline_dates(selected_date, n_years)
+data_url = vpts_url(radar_stat, selected_date)
 
 
 ### sunrise and sunset time for plots
-# Get the sunrise and sunset times for the specified date and observer
-sun_times = sun(observer, date=selected_date)
-
-# Extract sunrise and sunset times
-sunrise = sun_times['sunrise'].strftime('%Y-%m-%d %H:%M:%S')
-sunset = sun_times['sunset'].strftime('%Y-%m-%d %H:%M:%S')
-
-# Print the results
-#print(f"Sunrise: {sunrise}")
-#print(f"Sunset: {sunset}")
-rad_el = filtered_df['elevation'].iloc[0] 
-rad_el = int(rad_el)
-
-# Load data
+# Looked up in the precomputed table, NaT during polar day or night
+sun_times = get_solar_table(year_sel).loc[(radar_stat, selected_date)]
+sun_lines = [(sun_times[event].strftime('%Y-%m-%d %H:%M:%S'), icon)
+             for event, icon in (('sunrise', "🌅"), ('sunset', "🌙")) if pd.notna(sun_times[event])]
+
+# Load data, baseline years already in the climatology store are not downloaded again
+clim_store = get_climatology_store()
+missing_dates = clim_store.missing(radar_stat, past_dates)
 st.write(f"Loading data from: {data_url}")
-try:
-    df = load_data(data_url)
-    dfY1 = load_data(url1)
-    dfY2 = load_data(url2)
-    dfY3 = load_data(url3)
-    st.write("Data loaded successfully!")
-except Exception as e:
-    st.error(f"Error loading data: {e}")
+frames, errors = fetch_vpts(radar_stat, [selected_date] + missing_dates, cache=get_vpts_cache(), columns=MTR_COLUMNS)
+# baseline years that could not be downloaded are not requested again for a day
+clim_store.add_failed(radar_stat, [date for date in missing_dates if date in errors])
+if selected_date in errors:
+    st.error(f"Error loading data: {errors[selected_date]}")
+    st.stop()
+clim_store.add_days(radar_stat, {date: frames[date] for date in missing_dates if date in frames})
+df_clim, past_found = clim_store.profile(radar_stat, past_dates)
+if not past_found:
+    st.error("No data available for the baseline years.")
     st.stop()
+if len(past_found) < len(past_dates):
+    st.warning(f"Missing baseline years: {', '.join(str(date.year) for date in past_dates if date not in past_found)}")
+df1 = frames[selected_date]
+st.write("Data loaded successfully!")
+past_years = sorted(date.year for date in past_found)
+past_label = f"{past_years[0]}-{past_years[-1]}" if len(past_years) > 1 else f"{past_years[0]}"
 
 # Display the first few rows of the dataframe
 #st.write("Data preview:")
@@ -231,21 +246,15 @@ except Exception as e:
 
 #df['DateStr'] = df['datetime'].strftime("%Y-%m-%dT%H:%M:%SZ")
 #new_df = df.pivot(index='height', columns='datetime')['dens'].fillna(0)
-df1 = df[['datetime', 'height','dens']]
-df1 = pd.DataFrame(df1)
-df1['datetime'] = pd.to_datetime(df1['datetime'], utc=True)
 df1['datetime_str'] = df1['datetime'].dt.strftime('%H:%M:%S')
 
 
-dfY1 = dfY1[['datetime', 'height','dens']]
-dfY2 = dfY2[['datetime', 'height','dens']]
-dfY3 = dfY3[['datetime', 'height','dens']]
-df_all = pd.concat([dfY1,dfY2,dfY3])
-df_all['datetime'] = pd.to_datetime(df_all['datetime'], utc=True)
-df_all['datetime_str'] = df_all['datetime'].dt.strftime('%H:%M:%S')
-
-# Group by 'datetime' and calculate the mean of 'dens'
-df_mean = df_all.groupby('datetime_str')['dens'].mean().reset_index()
+# Mean of 'dens' per time of day over all heights and baseline years
+df_mean = df_clim.groupby('tbin')[['sum', 'count']].sum()
+df_mean = pd.DataFrame({
+    'datetime_str': [f'{tbin // 60:02d}:{tbin % 60:02d}:00' for tbin in df_mean.index],
+    'dens': df_mean['sum'] / df_mean['count'],
+})
 # mean of selected day
 df_mean_cur = df1.groupby('datetime_str')['dens'].mean().reset_index()
 
@@ -260,7 +269,7 @@ fig0.add_trace(go.Scatter(
     x=df_mean['datetime_str'],
     y=df_mean['dens'],
     mode='lines+markers',
-    name='Mean density 2021-2023',
+    name=f'Mean density {past_label}',
     line=dict(color='blue')
 ))
 
@@ -269,7 +278,7 @@ fig0.add_trace(go.Scatter(
     x=df_mean_cur['datetime_str'],
     y=df_mean_cur['dens'],
     mode='lines+markers',
-    name= f'Density 2024',
+    name= f'Density {year_sel}',
     line=dict(color='red')
 ))
 
@@ -291,45 +300,46 @@ fig0.update_layout(
 st.plotly_chart(fig0, use_container_width=True)
 
 
-glob_dens = df1['dens'].sum()
-glob_dens_past = df_all['dens'].sum()
-print(glob_dens_past)
-
 ## critical values in rotor swept area
-df_crit = df1[df1['height'].between(rad_el, rad_el+crit_height)]
-df_crit_past = df_all[df_all['height'].between(rad_el, rad_el+crit_height)]
-crit_dens_past = df_crit_past['dens'].sum()
-#print(df_crit.dtypes)
-crit_dens = df_crit['dens'].sum()
-performance_value=crit_dens/glob_dens
-performance_value_past=crit_dens_past/glob_dens_past
-
-# make a datetime index
-df1['datetime'] = pd.to_datetime(df1['datetime'])
+grid_times, grid_heights, dens_grid = density_grid(df1)
+performance_value = swept_exposure(dens_grid, grid_heights, turbines, sum_axes=0)['fraction'][0]
+
+# baseline: densities summed over the day per height bin
+profile_past = df_clim.groupby('height')['sum'].sum()
+performance_value_past = swept_exposure(profile_past.to_numpy(), profile_past.index.to_numpy(), turbines)['fraction'][0]
+
+# migration traffic of the selected day, over the whole profile and through the rotor swept area
+day_passage = nightly_passage({radar_stat: df1}, turbines)
+
+# density in the rotor swept area split by night, civil twilight and day
+period_profiles = split_exposure(grid_times, dens_grid, filtered_df['latitude'].iloc[0], filtered_df['longitude'].iloc[0])
+period_density = {period: swept_exposure(profile, grid_heights, turbines)['density'][0]
+                  for period, profile in period_profiles.items()}
+
 #print(df_mean_cur)
 
 
 # Streamlit app
 st.subheader(f'Height distribution at the {selected_date}')
+# The dense grid is reduced to at most MAX_COLUMNS time steps before it is sent to the browser
+heatmap_times, heatmap_values = downsample_grid(grid_times, dens_grid)
 fig = go.Figure(data=go.Heatmap(
-        z=df1['dens'],
-        x=df1['datetime'],
-        y=df1['height'],
+        z=heatmap_values.T,
+        x=heatmap_times,
+        y=grid_heights,
         colorscale='Viridis'
 ))
 
 
-# Identify the highest value in 'density'
-max_value = df1['dens'].max()
-max_index = df1['dens'].idxmax()
-max_time = df1['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')[max_index]
-max_h = df1['datetime'].dt.strftime('%H:%M:%S')[max_index]
-max_dens_at_max_height = df1['height'][max_index]  
-#print(max_dens_at_max_height)
+# Identify the highest value in 'density' on the full resolution grid
+max_value, max_datetime, max_dens_at_max_height = grid_max(grid_times, grid_heights, dens_grid)
+max_time = pd.Timestamp(max_datetime).strftime('%Y-%m-%d %H:%M:%S')
+max_h = pd.Timestamp(max_datetime).strftime('%H:%M:%S')
+start_time = pd.Timestamp(grid_times[0]).strftime('%Y-%m-%d %H:%M:%S')
 
 fig.add_annotation(
-    x=df1['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')[max_index],
-    y='height',
+    x=max_time,
+    y=max_dens_at_max_height,
     text=f"Max: {max_value:.2f}",
     showarrow=True,
     arrowhead=3,
@@ -342,51 +352,34 @@ fig.add_annotation(
 # Draw vertical and horizontal lines from the peak value
 fig.add_shape(
     type="line",
-    x0=df1['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')[max_index], x1=df1['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')[max_index],
+    x0=max_time, x1=max_time,
     y0=0, y1=4800,  # y0 and y1 define the height range for the line
     line=dict(color="red", width=2, dash="dash")
 )
 
 
-# Draw vertical line for the sunrise
-fig.add_shape(
-    type="line",
-    x0=sunrise, x1=sunrise,
-    y0=4800, y1=5300,  # y0 and y1 define the height range for the line
-    line=dict(color="black", width=2)
-)
-
-# Draw vertical line for the sunset
-fig.add_shape(
-    type="line",
-    x0=sunset, x1=sunset,
-    y0=4800, y1=5300,  # y0 and y1 define the height range for the line
-    line=dict(color="black", width=2)
-)
-
-fig.add_annotation(
-    x=sunrise,  # Position at x=3 (same as the vertical line)
-    y=5350,  # Position above the plot (you can adjust this)
-    text="🌅",  # This can be any emoji or text
-    showarrow=False,
-    font=dict(size=20),
-    yshift=20  # Shifts the icon/text upwards
-)
-
-fig.add_annotation(
-    x=sunset,  # Position at x=3 (same as the vertical line)
-    y=5350,  # Position above the plot (you can adjust this)
-    text="🌙",  # This can be any emoji or text
-    showarrow=False,
-    font=dict(size=20),
-    yshift=20  # Shifts the icon/text upwards
-)
+# Draw vertical lines and icons for the sunrise and sunset
+for sun_time, icon in sun_lines:
+    fig.add_shape(
+        type="line",
+        x0=sun_time, x1=sun_time,
+        y0=4800, y1=5300,  # y0 and y1 define the height range for the line
+        line=dict(color="black", width=2)
+    )
+    fig.add_annotation(
+        x=sun_time,  # Position at the vertical line
+        y=5350,  # Position above the plot (you can adjust this)
+        text=icon,  # This can be any emoji or text
+        showarrow=False,
+        font=dict(size=20),
+        yshift=20  # Shifts the icon/text upwards
+    )
 
 # Draw horizontal line for dens at max height
 fig.add_shape(
     type="line",
-    x0=df1['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')[0],  # Start of the line on the x-axis
-    x1=df1['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')[max_index],  # End of the line on the x-axis
+    x0=start_time,  # Start of the line on the x-axis
+    x1=max_time,  # End of the line on the x-axis
     y0=max_dens_at_max_height,  # Horizontal line at dens value
     y1=max_dens_at_max_height,  # Same as y0 to keep it horizontal
     line=dict(color="red", width=2, dash="dash"),
@@ -433,7 +426,7 @@ fig2 = go.Figure(go.Indicator(
 fig3 = go.Figure(go.Indicator(
     mode = "gauge+number",
     value = performance_percentage_past,
-    title = {'text': "Mean 2021-2023"},
+    title = {'text': f"Mean {past_label}"},
     gauge = {
         'axis': {'range': [0, 100]},
         'bar': {'color': "darkblue"},
@@ -458,3 +451,17 @@ with col1:
 with col2:
     st.plotly_chart(fig3, use_container_width=True)
 
+
+# Share of the rotor swept area density falling into night, civil twilight and day
+st.subheader('Birds within the rotor swept area by time of day')
+total_density = sum(period_density.values())
+for column, period in zip(st.columns(len(PERIODS)), PERIODS):
+    share = period_density[period] / total_density * 100 if total_density > 0 else 0
+    column.metric(period.capitalize(), f"{share:.1f} %")
+
+# Migration traffic rate: birds crossing 1 km perpendicular to the flight direction
+st.subheader('Migration traffic during the selected day')
+col1, col2, col3 = st.columns(3)
+col1.metric("Passage", f"{day_passage['passage'].sum():,.0f} birds/km")
+col2.metric("Peak traffic rate", f"{day_passage['peak_mtr'].max():,.0f} birds/km/h")
+col3.metric("Passage through the rotor swept area", f"{day_passage['swept_passage'].sum():,.0f} birds/km")
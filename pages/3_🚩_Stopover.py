@@ -1,72 +1,37 @@
+import os
 import streamlit as st
 import pandas as pd
 import requests
 import matplotlib.pyplot as plt
-import geopandas as gpd
-from shapely.geometry import Polygon, Point
-import h3
 import pydeck as pdk
-import json
 import plotly.express as px
+from birdrisk import hexbin
+from birdrisk.cube import CUBE_PATH, monthly_counts, read_cube
+from birdrisk.occurrences import STOPOVER_SPECIES, OccurrenceStore
 
 
 st.set_page_config(layout="wide")
 
 # Bounding box coordinates for a region in Norway (replace with actual subregion coordinates)
-species_options = [
-    "Anser fabalis",        
-    "Numenius phaeopus",      
-    "Lymnocryptes minimus",         
-    "Tachybaptus ruficollis",  
-    "Gavia adamsii",           
-]
-
-# GBIF API base URL for occurrence data
-GBIF_API_URL = "https://api.gbif.org/v1/occurrence/search"
-
-# Function to get GBIF data for a specific species and year, with pagination
-def get_gbif_data(species, year=None):
-    limit = 300  # Maximum limit for each request
-    offset = 0   # Starting point for pagination
-    all_records = []  # List to store all retrieved records
-
-    params = {
-        "scientificName": species,
-        "hasCoordinate": "true",  # Only include records with coordinates
-        "publishingCountry": "NO",  # Filter by publishing country (example: NO for Norway)
-        "limit": limit,             # Number of records to retrieve per request
-        "offset": offset            # Offset for pagination
-    }
-
-    # Add year filter if specified
-    if year:
-        params["year"] = year
-
-    while True:
-        response = requests.get(GBIF_API_URL, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            if 'results' in data:
-                all_records.extend(data['results'])  # Add the current page of results
-                if len(data['results']) < limit:
-                    break  # No more records to fetch, exit loop
-                offset += limit  # Move to the next page of results
-                params["offset"] = offset
-            else:
-                break  # No results, exit loop
-        else:
-            st.error(f"Error fetching data from GBIF: {response.status_code}")
-            break
+species_options = list(STOPOVER_SPECIES)
 
-    # Look for media (images) in the occurrence records
-    for rec in all_records:
-        media = rec.get("media")
-        if media:
-            for item in media:
-                if item.get("type") == "StillImage":
-                    rec['image_url'] = item.get("identifier")  # Store the image URL
+# Occurrences are kept on disk per species and year and refreshed with the records changed since the last sync
+@st.cache_resource
+def get_occurrence_store():
+    return OccurrenceStore()
 
-    return all_records
+
+# Function to get GBIF data for a specific species and year. The first download fetches all
+# pages in parallel, later ones only the records modified since the last sync
+def get_gbif_data(species, year=None):
+    try:
+        frame = get_occurrence_store().sync(species, year)
+    except requests.RequestException as e:
+        st.error(f"Error fetching data from GBIF: {e}")
+        return []
+
+    # records as dicts, missing values as None
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
 
 # Function to parse GBIF data and convert to DataFrame
 def parse_gbif_data(data):
@@ -86,80 +51,47 @@ def parse_gbif_data(data):
 
     return pd.DataFrame(parsed_data)
 
-# Function to create H3 hexagonal grid and aggregate occurrences
-def create_h3_grid(df, resolution=5):
-    # Generate H3 hex index for each point
-    df['h3_index'] = df.apply(lambda row: h3.latlng_to_cell(row['LAT'], row['LON'], resolution), axis=1)
-
-    # Get unique hexagons from the H3 indices
-    unique_hexagons = df['h3_index'].unique()
-
-    # Convert the H3 hexagons back to polygons
-    hexagons = []
-    for hex_index in unique_hexagons:
-        hex_boundary = h3.cell_to_boundary(hex_index)  # Returns list of lat/lon tuples
-        hexagon = Polygon([(lat, lon) for lon, lat in hex_boundary])  # Convert to Polygon
-        hexagons.append((hex_index, hexagon))
-
-    # Create a GeoDataFrame for hexagons
-    hex_gdf = gpd.GeoDataFrame(hexagons, columns=['h3_index', 'geometry'])
-
-    # Create a GeoDataFrame for the points
-    geometry = [Point(xy) for xy in zip(df['LON'], df['LAT'])]
-    point_gdf = gpd.GeoDataFrame(df, geometry=geometry)
-    hex_gdf = hex_gdf.rename(columns={'h3_index': 'hex_index'})
-    # Spatial join: find points that fall within each hexagon
-    joined = gpd.sjoin(point_gdf, hex_gdf, how='left', op='within')
-    #print(joined)
-
-    # Count occurrences in each hexagon
-    hex_counts = joined.groupby('hex_index').size().reset_index(name='counts')
-
-    # Merge the counts back into the hex_gdf
-    hex_gdf = hex_gdf.merge(hex_counts, on='hex_index', how='left')
-    hex_gdf['counts'] = hex_gdf['counts'].fillna(0).astype(int)  # Fill missing counts with 0
-    #print(hex_gdf)
-
-    return hex_gdf
-
-# Function to convert GeoDataFrame hexagons to pydeck-friendly format
-def hexagons_to_pydeck_geojson(hex_gdf):
-    features = []
-    for _, row in hex_gdf.iterrows():
-        feature = {
-            "type": "Feature",
-            "geometry": row['geometry'].__geo_interface__,
-            "properties": {"counts": row['counts']}
-        }
-        features.append(feature)
-    
-    geojson = {
-        "type": "FeatureCollection",
-        "features": features
-    }
-    print(geojson)
-    
-    return geojson
+# Occurrence counts on the H3 grid for resolutions 3 to 8, built once per species and year.
+# Only the finest level is indexed, the coarser ones add up the counts per parent cell
+@st.cache_data(ttl=3600)
+def get_hex_pyramid(species, year, _df):
+    return hexbin.hex_pyramid(_df['LAT'].to_numpy(), _df['LON'].to_numpy())
+
+# Slices of the prebuilt occurrence cube (python -m birdrisk.cube), None if the cube does not cover them.
+# cube_version is the modification time of the cube, so a rebuilt cube is read again
+@st.cache_data(ttl=3600)
+def get_cube_hexes(species, year, resolution, cube_version):
+    hexes = read_cube(species=species, years=year, resolution=resolution, columns=['hex_index', 'counts'])
+    if hexes.empty:
+        return None
+    return hexes.groupby('hex_index', as_index=False)['counts'].sum().sort_values('counts', ascending=False)
+
+@st.cache_data(ttl=3600)
+def get_cube_months(species, cube_version):
+    months = monthly_counts(species=species)
+    return months if not months.empty else None
+
+cube_version = os.path.getmtime(CUBE_PATH) if os.path.exists(CUBE_PATH) else None
 
 # Streamlit app layout
 st.title("Observation data")
 
 
 # Sidebar input for species name
-species_options = [
-    "Anser fabalis",        
-    "Numenius phaeopus",      
-    "Lymnocryptes minimus",         
-    "Tachybaptus ruficollis",  
-    "Gavia adamsii",           
-]
+species_options = list(STOPOVER_SPECIES)
 species_input = st.sidebar.selectbox("Select Species", species_options)
 year_input = st.sidebar.slider("Select Year", min_value=2010, max_value=2024, value=2023)
+resolution_input = st.sidebar.slider("Hexagon resolution", min_value=min(hexbin.PYRAMID_RESOLUTIONS),
+                                     max_value=max(hexbin.PYRAMID_RESOLUTIONS), value=5)
 
 
 
-# Fetch and display GBIF data when button is clicked
+# Fetch and display GBIF data when button is clicked, the data stays on screen while only
+# the resolution changes
 if st.sidebar.button("Fetch Data"):
+    st.session_state['fetched'] = (species_input, year_input)
+
+if st.session_state.get('fetched') == (species_input, year_input):
     with st.spinner("Fetching data..."):
         gbif_data = get_gbif_data(species_input, year=year_input)
 
@@ -173,27 +105,30 @@ if st.sidebar.button("Fetch Data"):
 
 
             
-            # Create a hexagonal grid and aggregate occurrences using H3
-            hex_grid = create_h3_grid(df, resolution=5)  # H3 resolution
-
-            # Convert hex grid to GeoJSON for pydeck
-            hex_geojson = hexagons_to_pydeck_geojson(hex_grid)
-            geojson_string = json.dumps(hex_geojson)
-            
-
-            # Create a pydeck Layer for hexagons
+            # Occurrences aggregated on the H3 grid at the selected resolution, from the cube if it has them
+            hex_grid = reference_grid = None
+            if cube_version:
+                hex_grid = get_cube_hexes(species_input, year_input, resolution_input, cube_version)
+                reference_grid = get_cube_hexes(species_input, year_input, 5, cube_version)
+            if hex_grid is None:
+                hex_pyramid = get_hex_pyramid(species_input, year_input, df)
+                hex_grid, reference_grid = hex_pyramid[resolution_input], hex_pyramid[5]
+
+            # Create a pydeck Layer for hexagons, drawn from the cell ids
             hex_layer = pdk.Layer(
-                "GeoJsonLayer",
-                hex_geojson,
+                "H3HexagonLayer",
+                hex_grid,
+                get_hexagon="hex_index",
                 opacity=0.8,
                 stroked=True,
                 filled=True,
                 extruded=True,  # Enable extrusion for 3D hexagons
                 wireframe=True,  # Adds a wireframe outline to each hexagon
-                get_fill_color="[255 - properties.counts * 10, 100 + properties.counts * 5, 150]",  # Dynamic color based on counts
+                get_fill_color="[255 - counts * 10, 100 + counts * 5, 150]",  # Dynamic color based on counts
                 get_line_color=[255, 255, 255],
-                get_elevation="properties.counts * 100",  # Set height based on counts
-                elevation_scale=10,
+                get_elevation="counts * 100",  # Set height based on counts
+                # coarser cells hold more occurrences, keep the tallest column as high as at resolution 5
+                elevation_scale=float(10 * reference_grid['counts'].max() / hex_grid['counts'].max()),
                 pickable=True
             )
 
@@ -238,9 +173,14 @@ if st.sidebar.button("Fetch Data"):
 
             # Render the deck in Streamlit
             
-            # Count occurrences per month
-            df['month'] = pd.to_datetime(df['date']).dt.month  # Extract month from eventDate
-            occurrences_per_month = df['month'].value_counts().sort_index()
+            # Count occurrences per month, from the cube if it has the species and year
+            cube_months = get_cube_months(species_input, cube_version) if cube_version else None
+            if cube_months is not None and (cube_months['year'] == year_input).any():
+                occurrences_per_month = cube_months[(cube_months['year'] == year_input) & (cube_months['month'] > 0)]
+                occurrences_per_month = occurrences_per_month.set_index('month')['counts'].sort_index()
+            else:
+                df['month'] = pd.to_datetime(df['date'], errors='coerce').dt.month  # Extract month from eventDate
+                occurrences_per_month = df['month'].value_counts().sort_index()
 
             # Create an interactive bar plot using plotly
             month_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
@@ -271,4 +211,22 @@ if st.sidebar.button("Fetch Data"):
             # Show the interactive plot in Streamlit
             st.plotly_chart(fig, use_container_width=True)
         else:
-            st.error("No valid data to display on the map.")
\ No newline at end of file
+            st.error("No valid data to display on the map.")
+
+
+# Stopover pattern of the species across all years of the cube, no GBIF requests needed
+cube_months = get_cube_months(species_input, cube_version) if cube_version else None
+if cube_months is not None:
+    st.subheader(f"Occurrences of {species_input} per month and year")
+    pattern = cube_months[cube_months['month'] > 0].pivot_table(index='year', columns='month', values='counts',
+                                                                 aggfunc='sum', fill_value=0)
+    pattern = pattern.reindex(columns=range(1, 13), fill_value=0)
+    fig_years = px.imshow(
+        pattern,
+        x=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'],
+        y=pattern.index.astype(str),
+        labels={'x': 'Month', 'y': 'Year', 'color': 'Occurrences'},
+        color_continuous_scale='Greens',
+        aspect='auto',
+    )
+    st.plotly_chart(fig_years, use_container_width=True)
@@ -1,57 +1,29 @@
 # streamlit_app.py
 
 import streamlit as st
-from google.oauth2 import service_account
-from google.cloud import bigquery
-import geopandas as gpd
-from shapely.geometry import Point
-import folium
-from streamlit_folium import st_folium
+from birdrisk.geo import range_rings
+from birdrisk.maplayers import map_figure, ring_layer, station_layer
+from birdrisk.radar_sites import get_radar_registry
 
 ## the developer branch
 
-# Create API client.
-credentials = service_account.Credentials.from_service_account_info(
-    st.secrets["gcp_service_account"]
-)
-client = bigquery.Client(credentials=credentials)
+df = get_radar_registry().sites
 
-# Perform query.
-# Uses st.cache_data to only rerun when the query changes or after 10 min.
 
-
-sql = """SELECT * FROM `visavis-312202.wp4_dev.radar_sites` """
-df = client.query_and_wait(sql).to_dataframe()
-
-
-def create_geodataframe(df):
-    # Create a GeoDataFrame
-    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df.longitude, df.latitude, crs="EPSG:4326"))
-    return gdf
-
-def create_map(gdf):
-    # Initialize a map centered at the mean location
-    m = folium.Map()
-
-    # Add points to the map
-    for _, row in gdf.iterrows():
-        folium.Marker(location=[row.geometry.y, row.geometry.x],icon=folium.Icon(icon='cloud', color='blue')).add_to(m)
-        
-    bounds = gdf.total_bounds  # [minx, miny, maxx, maxy]
-    m.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
-
-
-    return m
+def create_map(df):
+    # One trace for all coverage circles and one for all stations
+    circles = range_rings(df['latitude'], df['longitude'], radii_km=50)[:, 0]
+    return map_figure([
+        ring_layer(circles, [0.5] * len(df), colorscale='Blues', opacity=0.3),
+        station_layer(df['latitude'], df['longitude'], df['radar']),
+    ], df['latitude'], df['longitude'], zoom=3, height=500)
 
 
 # Print results.
 st.title("Radar stations")
 st.write("Test to connect from google cloud BigQuery")
 st.dataframe(df)
-gdf = create_geodataframe(df)
-
 
-folium_map = create_map(gdf)
-st_folium(folium_map, width=700, height=500)
 
-    
\ No newline at end of file
+radar_map = create_map(df)
+st.plotly_chart(radar_map, use_container_width=True)